@@ -1,41 +1,217 @@
 from flask_cors import CORS
-from flask import Flask, request, send_from_directory, jsonify
+from flask import Flask, request, send_from_directory, jsonify, Response
 import argparse
 import json
+import os
+import resource
+
+import numpy as np
 
 from structure import Structure
+from binary_format import MIMETYPE, encode_layer, encode_value_cube
+from layer_store import to_json_layer, layer_part
+from response_cache import ResponseCache
+from vector_tiles import TileSourceCache, tile_path, MIMETYPE as TILE_MIMETYPE
+from consts import response_cache_max_bytes, tiles_data_dir, tile_cache_max_bytes, tile_source_cache_size
 
 app = Flask(__name__)
 CORS(app)
 
-app.debug  = True
-
 
 structure = Structure()
 # structure.startServer()
 
+# Encoded layer bodies, reused while the user scrubs through years
+response_cache = ResponseCache(response_cache_max_bytes)
+
+# Vector tiles cut on demand, and the indexed layers they are cut from
+tile_cache = ResponseCache(tile_cache_max_bytes)
+tile_sources = TileSourceCache(tile_source_cache_size)
+
+
+def wants_binary():
+    """
+    Binary typed arrays when asked for with ?format=bin or an Accept header
+    preferring application/octet-stream, JSON otherwise.
+    """
+    if "format" in request.args:
+        return request.args["format"] == "bin"
+    return request.accept_mimetypes.best_match(["application/json", MIMETYPE]) == MIMETYPE
+
+def cached_response(entry):
+    """
+    Response for a cached body, with its strong ETag. A matching If-None-Match gets a 304.
+    """
+    response = Response(entry.body, mimetype=entry.mimetype)
+    response.set_etag(entry.etag)
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+def layer_response(key, load_layer):
+    """
+    Serve an immutable layer from the encoded-response cache, keyed by
+    key + (format,). load_layer is only called on a cache miss, and a key of
+    None bypasses the cache. Responses carry a strong ETag and a matching
+    If-None-Match gets a 304.
+    """
+    binary_format = wants_binary()
+    # Binary clients can ask for the pipeline-quantized value codes with ?quantize=1,
+    # and for palette indices instead of RGBA point colors with ?palette=1
+    quantized = binary_format and request.args.get("quantize") == "1"
+    palette = binary_format and request.args.get("palette") == "1"
+    if key is not None:
+        encoding = "bin" + ("-q" if quantized else "") + ("-p" if palette else "") if binary_format else "json"
+        key = key + (encoding,)
+
+    entry = response_cache.get(key) if key is not None else None
+    if entry is None:
+        binary = load_layer()
+        if binary is None:
+            return jsonify(binary)
+
+        if binary_format:
+            body, mimetype = encode_layer(binary, quantized, palette), MIMETYPE
+        else:
+            body, mimetype = jsonify(to_json_layer(binary)).get_data(), "application/json"
+        entry = response_cache.put(key, body, mimetype) if key is not None else ResponseCache.entry(body, mimetype)
+
+    response = cached_response(entry)
+    response.vary.add("Accept")
+    return response
+
+
+def parse_bbox():
+    """
+    Optional bbox=min_lon,min_lat,max_lon,max_lat query parameter. Raises
+    ValueError unless it is four finite numbers.
+    """
+    if "bbox" not in request.args:
+        return None
+    bbox = tuple(float(v) for v in request.args["bbox"].split(","))
+    if len(bbox) != 4 or not np.all(np.isfinite(bbox)):
+        raise ValueError(f"Invalid bbox: {request.args['bbox']}")
+    return bbox
+
+
+def parse_number(name):
+    """
+    Optional numeric query parameter such as zoom. Raises ValueError unless it is a finite number.
+    """
+    if name not in request.args:
+        return None
+    value = float(request.args[name])
+    if not np.isfinite(value):
+        raise ValueError(f"Invalid {name}: {request.args[name]}")
+    return value
+
 
 @app.route("/pt_layer_data", methods=("GET",))
 def handle_pt_layer_data():
+    # part=geometry sends positions and ids once, part=attributes only the per-year values and colors
+    part = request.args.get("part")
     var_name = request.args["var_name"]
+
+    # Map zoom, low zooms are served from the aggregated pyramid levels
+    try:
+        zoom = parse_number("zoom")
+    except ValueError:
+        return jsonify({"error": "zoom must be a number."}), 400
+    level = structure.get_lod_level(var_name, "", zoom)
+
+    # Viewport requests only carry the points in view, with their original ids.
+    # They are not cached, every pan produces a new bounding box.
+    try:
+        bbox = parse_bbox()
+    except ValueError:
+        return jsonify({"error": "bbox must be min_lon,min_lat,max_lon,max_lat."}), 400
+    if bbox is not None:
+        year = None if part == "geometry" else request.args["year"]
+        return layer_response(None, lambda: layer_part(structure.get_points_in_bbox(var_name, year, "", bbox, zoom), part))
+
+    if part == "geometry":
+        return layer_response(("", var_name, None, part, level), lambda: layer_part(structure.get_point_geometry(var_name, "", zoom), part))
+
     year = request.args["year"]
     print(var_name, year)
-    binary = structure.get_points(var_name, year, "")
+    response = layer_response(("", var_name, year, part, level), lambda: layer_part(structure.get_points(var_name, year, "", zoom), part))
     print("sending point")
 
     # return json.dumps(gjson)
-    return jsonify(binary)
+    return response
+
+@app.route("/pt_layer_cube", methods=("GET",))
+def handle_pt_layer_cube():
+    # Every year of a variable in one binary payload, see binary_format.encode_value_cube
+    var_name = request.args["var_name"]
+
+    key = ("", var_name, "cube")
+    entry = response_cache.get(key)
+    if entry is None:
+        cube = structure.get_value_cube(var_name, "")
+        if cube is None:
+            return jsonify({"error": f"No point data for {var_name}."}), 404
+
+        entry = response_cache.put(key, encode_value_cube(cube), MIMETYPE)
+
+    return cached_response(entry)
 
 @app.route("/pol_layer_data", methods=("GET",))
 def handle_pol_layer_data():
     s_agg = "" if "s_agg" not in request.args else request.args["s_agg"]
     var_name = request.args["var_name"]
     year = request.args["year"]
+
+    # Simplified tract geometry for a map zoom, or for an explicit tolerance in degrees
+    try:
+        zoom = parse_number("zoom")
+        tolerance = parse_number("tolerance")
+    except ValueError:
+        return jsonify({"error": "zoom and tolerance must be numbers."}), 400
+    tolerance = structure.get_simplify_tolerance(var_name, s_agg, zoom, tolerance)
+
     print(var_name, year, s_agg)
-    binary = structure.get_points(var_name, year, s_agg)
+    response = layer_response((s_agg, var_name, year, None, tolerance), lambda: structure.get_polygons(var_name, year, s_agg, tolerance=tolerance))
     print("sending pol")
     # return json.dumps(gjson)
-    return jsonify(binary)
+    return response
+
+@app.route("/tiles/<s_agg>/<var_name>/<year>/<int:z>/<int:x>/<int:y>.mvt", methods=("GET",))
+def handle_tile(s_agg, var_name, year, z, x, y):
+    if not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return jsonify({"error": "Tile out of range."}), 404
+
+    key = (s_agg, var_name, year, z, x, y)
+    entry = tile_cache.get(key)
+    if entry is None:
+        # Pre-seeded tiles first, then cut the tile from the layer
+        path = tile_path(tiles_data_dir, s_agg, var_name, year, z, x, y)
+        if os.path.isfile(path):
+            with open(path, 'rb') as f:
+                body = f.read()
+        else:
+            def load_layer():
+                layer = structure.get_points(var_name, year, s_agg)
+                return layer if layer is not None and ("tracts" in layer or "vertices" in layer) else None
+
+            tiles = tile_sources.get((s_agg, var_name, year), load_layer)
+            if tiles is None:
+                return jsonify({"error": f"No tract layer for {var_name} {year}."}), 404
+            body = tiles.encode(z, x, y) or b""
+        entry = tile_cache.put(key, body, TILE_MIMETYPE)
+
+    return cached_response(entry)
+
+def parse_lat_lon():
+    """
+    lat and lon query parameters, None unless both are finite numbers.
+    """
+    try:
+        lat, lon = float(request.args["lat"]), float(request.args["lon"])
+    except (KeyError, ValueError):
+        return None
+    return (lat, lon) if np.isfinite(lat) and np.isfinite(lon) else None
+
 
 @app.route("/risk_data", methods=("GET",))
 def handle_point_feature():
@@ -44,13 +220,83 @@ def handle_point_feature():
         pt_idx = int(request.args["pt_idx"])
     
     else:
-        pt_idx = (float(request.args["lat"]), float(request.args["lon"]))
+        # NaN has no nearest point
+        pt_idx = parse_lat_lon()
+        if pt_idx is None:
+            return jsonify({"error": "lat and lon must be finite numbers."}), 400
+
+    # The body is rendered by the risk store, there is no per-request dict building
+    return Response(structure.get_risk_json(pt_idx), mimetype="application/json")
+
+
+@app.route("/point_series", methods=("GET",))
+def handle_point_series():
+    # Yearly history of every variable at one point, by pt_idx or nearest to lat/lon
+    if "pt_idx" in request.args:
+        point_series = structure.get_point_series(pt_idx=int(request.args["pt_idx"]))
+    elif "lat" in request.args and "lon" in request.args:
+        lat_lon = parse_lat_lon()
+        if lat_lon is None:
+            return jsonify({"error": "lat and lon must be finite numbers."}), 400
+        point_series = structure.get_point_series(lat=lat_lon[0], lon=lat_lon[1])
+    else:
+        return jsonify({"error": "Expected pt_idx or lat and lon."}), 400
+
+    return jsonify(point_series)
+
+
+@app.route("/risk_data/batch", methods=("POST",))
+def handle_risk_batch():
+    # Body: {"pt_idx": [...]} or {"lat": [...], "lon": [...]}
+    body = request.get_json(silent=True)
+    if body is None:
+        body = {}
+    if not isinstance(body, dict):
+        return jsonify({"error": "Expected a JSON object."}), 400
+
+    try:
+        if isinstance(body.get("pt_idx"), list):
+            # Indices are whole numbers that fit the int64 index arrays, 1.7 is not index 1
+            if any(isinstance(i, float) and not i.is_integer() for i in body["pt_idx"]):
+                raise ValueError
+            pt_idx = [int(i) for i in body["pt_idx"]]
+            if any(not -2 ** 63 <= i < 2 ** 63 for i in pt_idx):
+                raise ValueError
+        elif isinstance(body.get("lat"), list) and isinstance(body.get("lon"), list) and len(body["lat"]) == len(body["lon"]):
+            lats = [float(lat) for lat in body["lat"]]
+            lons = [float(lon) for lon in body["lon"]]
+            # JSON NaN and Infinity parse, but have no nearest point
+            if not np.all(np.isfinite(lats + lons)):
+                raise ValueError
+        else:
+            return jsonify({"error": "Expected pt_idx or lat and lon arrays of the same length."}), 400
+    except (TypeError, ValueError, OverflowError):
+        return jsonify({"error": "pt_idx must be an array of integers, lat and lon arrays of finite numbers."}), 400
+
+    if isinstance(body.get("pt_idx"), list):
+        risk_data = structure.get_risk_batch(pt_idx=pt_idx)
+    else:
+        risk_data = structure.get_risk_batch(lats=lats, lons=lons)
 
-    risk_data = structure.get_risk_data(pt_idx)
-    
     return jsonify(risk_data)
 
 
+def raise_open_file_limit():
+    # Every memory-mapped geometry column keeps a file descriptor open
+    _, hard_limit = resource.getrlimit(resource.RLIMIT_NOFILE)
+    try:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard_limit, hard_limit))
+    except (ValueError, OSError) as e:
+        print(f"Could not raise the open file limit: {e}")
+
+def load_data():
+    """
+    Load every dataset served by the app. serve.py calls this once before forking its workers.
+    """
+    raise_open_file_limit()
+    structure.load_binary()
+    structure.load_risk()
+
 # @app.route("/point_feature", methods=("GET",))
 # def handle_point_feature():
 #     pt_feature = structure.get_point_feature("tmin")
@@ -71,9 +317,9 @@ def main():
     #     exit(1)
 
     # structure.process_files()
-    structure.load_binary()
-    structure.load_risk()
+    load_data()
     print("Go!")
+    app.debug  = True
     app.run()
     print()
 
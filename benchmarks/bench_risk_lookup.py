@@ -0,0 +1,84 @@
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import lat_min, lat_max, lon_min, lon_max
+from consts import risk_properties
+from spatial_index import SphereIndex
+from structure import Structure
+
+
+def build_risk_frame(n_points, seed=0):
+    """
+    Build a synthetic risk frame with the same columns as Illinois_prcp_risks_round.feather.
+    """
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        column: np.round(rng.uniform(10, 300, n_points), 2) for column in risk_properties
+    })
+    df['latitude'] = np.round(rng.uniform(lat_min, lat_max, n_points), 4)
+    df['longitude'] = np.round(rng.uniform(lon_min, lon_max, n_points), 4)
+    return df
+
+
+def linear_nearest(df, lat, lon):
+    """
+    The original lookup: haversine distance to every row followed by np.argmin.
+    """
+    distances = Structure.haversine_distance(lat, lon, df['latitude'].values, df['longitude'].values)
+    return df.index[np.argmin(distances)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare linear and indexed nearest-point risk lookups.')
+    parser.add_argument('-n', '--points', type=int, default=200000, help='Number of synthetic grid points.')
+    parser.add_argument('-q', '--queries', type=int, default=500, help='Number of random lat/lon lookups.')
+    args = parser.parse_args()
+
+    df = build_risk_frame(args.points)
+    rng = np.random.default_rng(1)
+    queries = np.column_stack((
+        rng.uniform(lat_min - 0.5, lat_max + 0.5, args.queries),
+        rng.uniform(lon_min - 0.5, lon_max + 0.5, args.queries),
+    ))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        feather_file = os.path.join(tmp_dir, "risks.feather")
+        df.to_feather(feather_file)
+
+        structure = Structure()
+        start = time.perf_counter()
+        structure.load_risk(feather_file)
+        load_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    expected = [linear_nearest(df, lat, lon) for lat, lon in queries]
+    linear_time = time.perf_counter() - start
+
+    index = SphereIndex(df['latitude'].values, df['longitude'].values)
+    start = time.perf_counter()
+    nearest = [df.index[index.nearest(lat, lon)] for lat, lon in queries]
+    index_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = [structure.get_risk_data((float(lat), float(lon))) for lat, lon in queries]
+    indexed_time = time.perf_counter() - start
+
+    # Both paths must resolve to the same row
+    mismatches = sum(1 for a, b in zip(expected, nearest) if a != b)
+    mismatches += sum(1 for idx, result in zip(expected, results) if structure.get_risk_data(int(idx)) != result)
+
+    print(f"points: {args.points}, queries: {args.queries}")
+    print(f"load_risk (incl. index build): {load_time * 1000:.1f} ms")
+    print(f"linear haversine:  {linear_time / args.queries * 1e6:.1f} us/lookup")
+    print(f"SphereIndex.nearest: {index_time / args.queries * 1e6:.1f} us/lookup")
+    print(f"indexed get_risk_data: {indexed_time / args.queries * 1e6:.1f} us/lookup")
+    print(f"mismatches: {mismatches}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,312 @@
+"""
+End-to-end benchmark on synthetic inputs (see benchmarks/synthetic.py).
+
+Every stage runs in its own freshly spawned process, inside a work directory
+whose ./files holds the synthetic inputs, and records:
+
+    wall_s          wall time of the stage
+    peak_rss_bytes  peak resident set of the stage process and its workers
+    bytes           bytes the stage produced: files written for the writers,
+                    the data they load from for the loaders, response bodies
+                    for the routes
+
+Stages, in order: the writers (write_binary_interp, write_binary,
+write_bin_polygon, write_gjson_polygon), Structure.load_binary,
+Structure.load_risk, then every Flask route through the test client, with
+the first (cold) request and the mean of the following (warm) ones.
+
+    python -m benchmarks.suite -n 25000 -t 3265 -o results.json
+    python -m benchmarks.suite -o new.json --compare results.json
+"""
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import math
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+
+import numpy as np
+
+from benchmarks.synthetic import generate, add_size_arguments, lat_min, lat_max, lon_min, lon_max
+
+files_dir = "files"
+
+
+def peak_rss():
+    """
+    Peak resident set in bytes of this process and of its waited-for children.
+    """
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    scale = 1 if sys.platform == "darwin" else 1024
+    return max(self_rss, children_rss) * scale
+
+
+def written_bytes(since):
+    """
+    Bytes of the files under ./files modified since a time.time() timestamp.
+    """
+    total = 0
+    for root, _, names in os.walk(files_dir):
+        for name in names:
+            stat = os.stat(os.path.join(root, name))
+            if stat.st_mtime >= since:
+                total += stat.st_size
+    return total
+
+
+def tree_bytes(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def read_tracts(name):
+    import geopandas as gpd
+    return gpd.read_file(os.path.join(files_dir, name))
+
+
+def stage_write_binary_interp(workers):
+    import write_binary_interp
+    write_binary_interp.process_files(write_binary_interp.geojson_files)
+
+
+def stage_write_binary(workers):
+    import write_binary
+    write_binary.process_files(write_binary.geojson_files, workers, force=True)
+
+
+def stage_write_bin_polygon(workers):
+    import write_bin_polygon
+    write_bin_polygon.process_files(write_bin_polygon.geojson_files, read_tracts("tl_2023_17_tract.json"), workers, force=True)
+
+
+def stage_write_gjson_polygon(workers):
+    import write_gjson_polygon
+    write_gjson_polygon.process_files_geojson(write_gjson_polygon.geojson_files, read_tracts("cb_2018_17_tract_500k.geojson"), 'GEOID', workers)
+
+
+def stage_load_binary(workers):
+    from consts import binary_data_dir
+    from structure import Structure
+    Structure().load_binary()
+    return tree_bytes(binary_data_dir)
+
+
+def stage_load_risk(workers):
+    from consts import risk_file
+    from structure import Structure
+    Structure().load_risk()
+    return tree_bytes(risk_file)
+
+
+writer_stages = [
+    ("write_binary_interp", stage_write_binary_interp),
+    ("write_binary", stage_write_binary),
+    ("write_bin_polygon", stage_write_bin_polygon),
+    ("write_gjson_polygon", stage_write_gjson_polygon),
+]
+load_stages = [
+    ("load_binary", stage_load_binary),
+    ("load_risk", stage_load_risk),
+]
+
+
+def tile_xy(lon, lat, z):
+    n = 2 ** z
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return x, y
+
+
+def route_requests(year):
+    """
+    (name, method, url, headers, json body) of every benchmarked request.
+    """
+    binary = {"Accept": "application/octet-stream"}
+    lat, lon = (lat_min + lat_max) / 2, (lon_min + lon_max) / 2
+    x, y = tile_xy(lon, lat, 8)
+    bbox = f"{lon - 0.5},{lat - 0.5},{lon + 0.5},{lat + 0.5}"
+    points = f"/pt_layer_data?var_name=tmin&year={year}"
+    tracts = f"/pol_layer_data?s_agg=ct&var_name=tmin&year={year}"
+    return [
+        ("pt_layer_data json", "GET", points, None, None),
+        ("pt_layer_data bin", "GET", points, binary, None),
+        ("pt_layer_data bin quantized palette", "GET", points + "&quantize=1&palette=1", binary, None),
+        ("pt_layer_data attributes bin", "GET", points + "&part=attributes", binary, None),
+        ("pt_layer_data zoom 5 bin", "GET", points + "&zoom=5", binary, None),
+        ("pt_layer_data bbox bin", "GET", points + f"&bbox={bbox}", binary, None),
+        ("pt_layer_cube bin", "GET", "/pt_layer_cube?var_name=tmin", binary, None),
+        ("pol_layer_data json", "GET", tracts, None, None),
+        ("pol_layer_data bin", "GET", tracts, binary, None),
+        ("pol_layer_data zoom 6 bin", "GET", tracts + "&zoom=6", binary, None),
+        ("tiles z8", "GET", f"/tiles/ct/tmin/{year}/8/{x}/{y}.mvt", None, None),
+        ("risk_data pt_idx", "GET", "/risk_data?pt_idx=100", None, None),
+        ("risk_data lat lon", "GET", f"/risk_data?lat={lat}&lon={lon}", None, None),
+        ("point_series lat lon", "GET", f"/point_series?lat={lat}&lon={lon}", None, None),
+        ("risk_data batch", "POST", "/risk_data/batch", None, {"pt_idx": list(range(0, 1000, 10))}),
+    ]
+
+
+def stage_routes(requests, repeat):
+    """
+    Time every request through the Flask test client. Returns the route results.
+    """
+    import app
+    app.load_data()
+    client = app.app.test_client()
+
+    results = []
+    for name, method, url, headers, body in requests:
+        times = []
+        for _ in range(repeat + 1):
+            start = time.perf_counter()
+            response = client.open(url, method=method, headers=headers, json=body)
+            times.append(time.perf_counter() - start)
+
+        results.append({
+            "name": name,
+            "url": url,
+            "status": response.status_code,
+            "bytes": len(response.get_data()),
+            "cold_ms": times[0] * 1000,
+            "warm_ms": float(np.mean(times[1:])) * 1000 if repeat else None,
+        })
+    return results
+
+
+def run_stage(work_dir, function, args, verbose, queue):
+    """
+    Body of a stage process: run function(*args) in work_dir and report its measures.
+    """
+    os.chdir(work_dir)
+    output = sys.stdout if verbose else io.StringIO()
+
+    start_time = time.time()
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(output):
+            result = function(*args)
+    except Exception:
+        queue.put({"error": traceback.format_exc()})
+        return
+    wall = time.perf_counter() - start
+
+    queue.put({"wall_s": wall, "peak_rss_bytes": peak_rss(), "result": result, "written": written_bytes(start_time)})
+
+
+def measure(work_dir, function, args, verbose):
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=run_stage, args=(work_dir, function, args, verbose, queue))
+    process.start()
+    measures = queue.get()
+    process.join()
+    if "error" in measures:
+        raise RuntimeError(f"{function.__name__} failed:\n{measures['error']}")
+    return measures
+
+
+def run_suite(work_dir, args):
+    results = {
+        "meta": {
+            "date": datetime.datetime.now().isoformat(timespec='seconds'),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "points": args.points,
+            "tracts": args.tracts,
+            "years": [args.first_year, args.last_year],
+            "seed": args.seed,
+            "workers": args.workers,
+            "repeat": args.repeat,
+        },
+        "stages": [],
+        "routes": [],
+    }
+
+    start = time.perf_counter()
+    inputs = generate(os.path.join(work_dir, files_dir), args.points, args.tracts, args.first_year, args.last_year, args.seed)
+    results["stages"].append({"name": "synthetic", "wall_s": time.perf_counter() - start, "peak_rss_bytes": None, "bytes": sum(inputs.values())})
+
+    for name, function in writer_stages:
+        measures = measure(work_dir, function, (args.workers,), args.verbose)
+        results["stages"].append({"name": name, "wall_s": measures["wall_s"], "peak_rss_bytes": measures["peak_rss_bytes"], "bytes": measures["written"]})
+        print(f"{name}: {measures['wall_s']:.2f} s")
+
+    for name, function in load_stages:
+        measures = measure(work_dir, function, (args.workers,), args.verbose)
+        results["stages"].append({"name": name, "wall_s": measures["wall_s"], "peak_rss_bytes": measures["peak_rss_bytes"], "bytes": measures["result"]})
+        print(f"{name}: {measures['wall_s']:.2f} s")
+
+    year = str((args.first_year + args.last_year) // 2)
+    measures = measure(work_dir, stage_routes, (route_requests(year), args.repeat), args.verbose)
+    results["stages"].append({"name": "routes", "wall_s": measures["wall_s"], "peak_rss_bytes": measures["peak_rss_bytes"], "bytes": sum(r["bytes"] for r in measures["result"])})
+    results["routes"] = measures["result"]
+    for route in results["routes"]:
+        print(f"{route['name']}: {route['status']}, {route['bytes']} bytes, cold {route['cold_ms']:.2f} ms, warm {route['warm_ms'] or 0:.2f} ms")
+
+    return results
+
+
+def compare(results, baseline):
+    """
+    Print the ratio of every measure to the same measure of a baseline run.
+    """
+    def ratio(new, old):
+        return f"{new / old:6.2f}x" if new is not None and old else "     -"
+
+    print(f"{'':40} {'time':>7} {'rss':>7} {'bytes':>7}")
+    old_stages = {stage["name"]: stage for stage in baseline["stages"]}
+    for stage in results["stages"]:
+        old = old_stages.get(stage["name"], {})
+        print(f"{stage['name']:40} {ratio(stage['wall_s'], old.get('wall_s'))} "
+              f"{ratio(stage['peak_rss_bytes'], old.get('peak_rss_bytes'))} {ratio(stage['bytes'], old.get('bytes'))}")
+
+    old_routes = {route["name"]: route for route in baseline["routes"]}
+    for route in results["routes"]:
+        old = old_routes.get(route["name"], {})
+        print(f"{route['name']:40} {ratio(route['warm_ms'], old.get('warm_ms'))} {'':>7} {ratio(route['bytes'], old.get('bytes'))}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the writers, the loaders and the routes on synthetic inputs.')
+    add_size_arguments(parser)
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Worker processes of the writers.')
+    parser.add_argument('-r', '--repeat', type=int, default=20, help='Warm requests per route.')
+    parser.add_argument('-o', '--output', default='benchmark_results.json', help='JSON file to write the results to.')
+    parser.add_argument('--compare', help='Results JSON of an earlier run to compare with.')
+    parser.add_argument('--work-dir', help='Keep the inputs and outputs in this directory instead of a temporary one.')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Show the output of every stage.')
+    args = parser.parse_args()
+
+    work_dir = os.path.abspath(args.work_dir) if args.work_dir else tempfile.mkdtemp(prefix="benchmark_")
+    try:
+        results = run_suite(work_dir, args)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Saved results to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+"""
+Deterministic synthetic inputs with the schema of the private ./files data.
+
+    Yearly_tmin_round.json, Yearly_tmax_round.json, Yearly_prcp_round.json
+        GeoJSON points on a regular grid over Illinois, one property per
+        year ("1980", ...) rounded to 0.01, about 1% of them missing (null)
+    Illinois_prcp_risks_round.json
+        the prcp points, also carrying the return-period risk columns
+    Illinois_prcp_risks_round.feather
+        the risk columns plus latitude and longitude, one row per point
+    tl_2023_17_tract.json, cb_2018_17_tract_500k.geojson
+        tract polygons with a GEOID, tiling the grid without gaps or overlaps
+
+The same arguments always produce the same files.
+
+    python -m benchmarks.synthetic files --points 25000 --tracts 3265
+"""
+
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from consts import risk_properties
+
+# Approximate bounding box of Illinois
+lat_min, lat_max = 36.97, 42.51
+lon_min, lon_max = -91.51, -87.49
+
+# Mean at the southern and the northern edge, and the noise of every variable
+variables = {
+    "tmin": (8.0, -2.0, 3.0),
+    "tmax": (22.0, 14.0, 3.0),
+    "prcp": (140.0, 90.0, 40.0),
+}
+
+missing_fraction = 0.01
+
+# Vertices along every tract edge, so simplification has something to remove
+edge_vertices = 6
+
+
+def grid_shape(n, width, height):
+    """
+    Columns and rows of a grid of about n cells over a width x height box.
+    """
+    nx = max(1, int(round(np.sqrt(n * width / height))))
+    return nx, max(1, int(round(n / nx)))
+
+
+def point_grid(n_points):
+    """
+    (n, 2) longitude/latitude of a regular grid of about n_points over Illinois.
+    """
+    nx, ny = grid_shape(n_points, lon_max - lon_min, lat_max - lat_min)
+    lons, lats = np.meshgrid(np.linspace(lon_min, lon_max, nx), np.linspace(lat_min, lat_max, ny))
+    return np.round(np.column_stack((lons.ravel(), lats.ravel())), 4)
+
+
+def year_values(rng, positions, years, south, north, noise):
+    """
+    (n_points, n_years) values: a north-south gradient, a slow trend and noise,
+    rounded to 0.01, NaN for the missing ones.
+    """
+    latitude = (positions[:, 1] - lat_min) / (lat_max - lat_min)
+    trend = np.linspace(0, noise / 2, len(years))
+    values = (south + (north - south) * latitude)[:, None] + trend + rng.normal(0, noise, (len(positions), len(years)))
+    values = np.round(values, 2)
+    values[rng.random(values.shape) < missing_fraction] = np.nan
+    return values
+
+
+def risk_values(rng, n_points):
+    """
+    (n_points, n_periods) risks growing with the return period, rounded to 0.01.
+    """
+    base = rng.uniform(20, 80, (n_points, 1))
+    growth = np.cumsum(rng.uniform(0.1, 0.4, (n_points, len(risk_properties))), axis=1)
+    return np.round(base * (1 + growth), 2)
+
+
+def point_features(positions, years, values, extra=None):
+    features = []
+    for row, (lon, lat) in enumerate(positions.tolist()):
+        properties = {year: None if np.isnan(v) else v for year, v in zip(years, values[row].tolist())}
+        if extra is not None:
+            properties.update(zip(risk_properties, extra[row].tolist()))
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [lon, lat]},
+            "properties": properties,
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+
+def tract_features(rng, n_tracts):
+    """
+    Tracts on a jittered lattice slightly larger than the point grid. Every
+    tract is the outline of its block of lattice cells, so neighbors share
+    their edges exactly.
+    """
+    pad = 0.01
+    nx, ny = grid_shape(n_tracts, lon_max - lon_min, lat_max - lat_min)
+    lons = np.linspace(lon_min - pad, lon_max + pad, nx * edge_vertices + 1)
+    lats = np.linspace(lat_min - pad, lat_max + pad, ny * edge_vertices + 1)
+    lattice = np.stack(np.meshgrid(lons, lats, indexing='ij'), axis=-1)
+
+    # Move the inner lattice vertices by up to a quarter of a lattice step
+    step = np.array([lons[1] - lons[0], lats[1] - lats[0]])
+    lattice[1:-1, 1:-1] += rng.uniform(-0.25, 0.25, lattice[1:-1, 1:-1].shape) * step
+
+    features = []
+    for i in range(nx):
+        for j in range(ny):
+            x0, x1 = i * edge_vertices, (i + 1) * edge_vertices
+            y0, y1 = j * edge_vertices, (j + 1) * edge_vertices
+            ring = np.concatenate((
+                lattice[x0:x1, y0], lattice[x1, y0:y1], lattice[x1:x0:-1, y1], lattice[x0, y1:y0:-1], lattice[x0:x0 + 1, y0],
+            ))
+            features.append({
+                "type": "Feature",
+                "geometry": {"type": "Polygon", "coordinates": [np.round(ring, 6).tolist()]},
+                "properties": {"GEOID": f"17{i:03d}{j:06d}"},
+            })
+    return {"type": "FeatureCollection", "features": features}
+
+
+def write_json(data, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, separators=(',', ':'))
+
+
+def generate(out_dir, n_points=25000, n_tracts=3265, first_year=1980, last_year=2023, seed=0):
+    """
+    Write every synthetic input file to out_dir. Returns {file name: bytes}.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    names = []
+
+    positions = point_grid(n_points)
+    years = [str(year) for year in range(first_year, last_year + 1)]
+    risks = risk_values(rng, len(positions))
+
+    for var_name, (south, north, noise) in variables.items():
+        values = year_values(rng, positions, years, south, north, noise)
+        names.append(f"Yearly_{var_name}_round.json")
+        write_json(point_features(positions, years, values), os.path.join(out_dir, names[-1]))
+        if var_name == "prcp":
+            names.append("Illinois_prcp_risks_round.json")
+            write_json(point_features(positions, years, values, risks), os.path.join(out_dir, names[-1]))
+
+    df = pd.DataFrame(risks, columns=risk_properties)
+    df['latitude'] = positions[:, 1]
+    df['longitude'] = positions[:, 0]
+    names.append("Illinois_prcp_risks_round.feather")
+    df.to_feather(os.path.join(out_dir, names[-1]))
+
+    tracts = tract_features(rng, n_tracts)
+    for name in ("tl_2023_17_tract.json", "cb_2018_17_tract_500k.geojson"):
+        names.append(name)
+        write_json(tracts, os.path.join(out_dir, name))
+
+    return {name: os.path.getsize(os.path.join(out_dir, name)) for name in names}
+
+
+def add_size_arguments(parser):
+    parser.add_argument('-n', '--points', type=int, default=25000, help='Approximate number of grid points.')
+    parser.add_argument('-t', '--tracts', type=int, default=3265, help='Approximate number of tracts.')
+    parser.add_argument('--first-year', type=int, default=1980, help='First year property.')
+    parser.add_argument('--last-year', type=int, default=2023, help='Last year property.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed.')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write synthetic inputs with the schema of ./files.')
+    parser.add_argument('out_dir', help='Directory to write the files to, e.g. ./files.')
+    add_size_arguments(parser)
+    args = parser.parse_args()
+
+    sizes = generate(args.out_dir, args.points, args.tracts, args.first_year, args.last_year, args.seed)
+    for name, size in sizes.items():
+        print(f"{name}: {size / 2**20:.1f} MiB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,294 @@
+"""
+Typed-array wire format for point and polygon layers.
+
+A payload is a small header, a block table and the block data:
+
+    header  <4sHHI   magic "UPLB", version, number of blocks, feature count
+    block   <8sBBHII name, dtype code, components per item, reserved,
+                     byte offset from the start of the payload, item count
+
+Every block starts on an 8-byte boundary, so a browser can wrap it in a
+typed array (Float32Array, Uint8Array, ...) without copying and hand it
+straight to deck.gl binary attributes.
+"""
+
+import struct
+
+import numpy as np
+
+MIMETYPE = "application/octet-stream"
+
+# Quantized uint16 value marking a missing value in a value cube
+NODATA = 65535
+
+MAGIC = b"UPLB"
+VERSION = 1
+ALIGNMENT = 8
+
+header_struct = struct.Struct("<4sHHI")
+block_struct = struct.Struct("<8sBBHII")
+
+dtype_codes = {
+    1: np.dtype("<u1"),
+    2: np.dtype("<u2"),
+    3: np.dtype("<u4"),
+    4: np.dtype("<f4"),
+    5: np.dtype("<f8"),
+}
+codes_by_dtype = {dtype: code for code, dtype in dtype_codes.items()}
+
+
+def _padding(size):
+    return -size % ALIGNMENT
+
+
+def encode_blocks(length, blocks):
+    """
+    Serialize a list of (name, array, components) blocks into one payload.
+    """
+    header_size = header_struct.size + block_struct.size * len(blocks)
+    offset = header_size + _padding(header_size)
+
+    table = []
+    data = []
+    for name, array, components in blocks:
+        array = np.ascontiguousarray(array)
+        code = codes_by_dtype[array.dtype.newbyteorder("<")]
+        table.append(block_struct.pack(name.encode("ascii"), code, components, 0, offset, array.size))
+        raw = array.astype(dtype_codes[code], copy=False).tobytes()
+        data.append(raw + b"\0" * _padding(len(raw)))
+        offset += len(data[-1])
+
+    head = header_struct.pack(MAGIC, VERSION, len(blocks), length) + b"".join(table)
+    return head + b"\0" * _padding(len(head)) + b"".join(data)
+
+
+def decode_blocks(payload):
+    """
+    Parse a payload back into (length, {name: array}). Arrays are views on the payload.
+    """
+    magic, version, n_blocks, length = header_struct.unpack_from(payload, 0)
+    if magic != MAGIC:
+        raise ValueError(f"Invalid payload magic: {magic!r}")
+    if version != VERSION:
+        raise ValueError(f"Unsupported payload version: {version}")
+
+    blocks = {}
+    for i in range(n_blocks):
+        name, code, components, _, offset, count = block_struct.unpack_from(
+            payload, header_struct.size + i * block_struct.size
+        )
+        array = np.frombuffer(payload, dtype=dtype_codes[code], count=count, offset=offset)
+        if components > 1:
+            array = array.reshape(-1, components)
+        blocks[name.rstrip(b"\0").decode("ascii")] = array
+    return length, blocks
+
+
+def _float_array(values):
+    """
+    Convert a list of floats (None for missing) into a float array with NaN for missing.
+    """
+    if isinstance(values, np.ndarray):
+        return values.astype(np.float32)
+    return np.array([np.nan if v is None else v for v in values], dtype=np.float32)
+
+
+def encode_point_layer(layer, quantized=False, palette=False):
+    """
+    Encode a point layer ({length, positions, colors, values, ids}) as typed arrays.
+    Fields missing from the layer (see layer_store.layer_part) are left out.
+    Layers storing palette indices send them as a u1 "bin" block plus the
+    "palette" block with palette=True, and expanded RGBA colors otherwise.
+    """
+    blocks = []
+    if "positions" in layer:
+        blocks.append(("position", np.asarray(layer["positions"], dtype=np.float32), 2))
+    if "bins" in layer and palette:
+        blocks.append(("bin", np.asarray(layer["bins"], dtype=np.uint8), 1))
+        blocks.append(("palette", np.asarray(layer["palette"], dtype=np.uint8), 4))
+    elif "bins" in layer:
+        blocks.append(("color", np.asarray(layer["palette"], dtype=np.uint8)[layer["bins"]], 4))
+    elif "colors" in layer:
+        blocks.append(("color", np.asarray(layer["colors"], dtype=np.uint8), 4))
+    if "values" in layer:
+        blocks.extend(_value_blocks(layer, quantized))
+    if "ids" in layer:
+        blocks.append(("id", np.asarray(layer["ids"], dtype=np.uint32), 1))
+    return encode_blocks(layer["length"], blocks)
+
+
+def _polygon_rings(geometry):
+    """
+    Return the list of polygons (each a list of rings) of a GeoJSON-like geometry.
+    """
+    if geometry["type"] == "Polygon":
+        return [geometry["coordinates"]]
+    if geometry["type"] == "MultiPolygon":
+        return geometry["coordinates"]
+    return []
+
+
+def flatten_polygons(geometries):
+    """
+    Flatten GeoJSON-like polygon geometries into flat arrays.
+
+    Returns:
+        vertices: Float32 (n_vertices, 2)
+        ring_starts: Uint32 (n_rings + 1), first vertex of each ring
+        polygon_starts: Uint32 (n_polygons + 1), first ring of each polygon (outer ring first, then holes)
+        polygon_features: Uint32 (n_polygons), feature each polygon belongs to
+    """
+    vertices = []
+    ring_starts = [0]
+    polygon_starts = [0]
+    polygon_features = []
+
+    for feature_idx, geometry in enumerate(geometries):
+        for polygon in _polygon_rings(geometry):
+            for ring in polygon:
+                vertices.extend(ring)
+                ring_starts.append(len(vertices))
+            polygon_starts.append(len(ring_starts) - 1)
+            polygon_features.append(feature_idx)
+
+    return (
+        np.array(vertices, dtype=np.float32).reshape(-1, 2),
+        np.array(ring_starts, dtype=np.uint32),
+        np.array(polygon_starts, dtype=np.uint32),
+        np.array(polygon_features, dtype=np.uint32),
+    )
+
+
+def _polygon_blocks(value_blocks, colors, geoids, vertices, ring_starts, polygon_starts, polygon_features):
+    """
+    Block list of a tract layer. Tract GEOIDs travel as a newline separated UTF-8 block.
+    """
+    geoids = "\n".join(str(geoid) for geoid in geoids).encode("utf-8")
+    return value_blocks + [
+        ("color", np.asarray(colors, dtype=np.uint8).reshape(-1, 4), 4),
+        ("id", np.arange(len(colors), dtype=np.uint32), 1),
+        ("geoid", np.frombuffer(geoids, dtype=np.uint8), 1),
+        ("vertex", np.asarray(vertices, dtype=np.float32).reshape(-1, 2), 2),
+        ("ring", np.asarray(ring_starts, dtype=np.uint32), 1),
+        ("polygon", np.asarray(polygon_starts, dtype=np.uint32), 1),
+        ("feature", np.asarray(polygon_features, dtype=np.uint32), 1),
+    ]
+
+
+def encode_polygon_layer(layer):
+    """
+    Encode a census-tract layer ({"tracts": [...]}) as typed arrays.
+    """
+    tracts = layer["tracts"]
+    blocks = _polygon_blocks(
+        [("value", _float_array([t["average_value"] for t in tracts]), 1)],
+        [t["color"] for t in tracts],
+        [t["GEOID"] for t in tracts],
+        *flatten_polygons([t["geometry"] for t in tracts]),
+    )
+    return encode_blocks(len(tracts), blocks)
+
+
+def encode_polygon_arrays(layer, quantized=False):
+    """
+    Encode an array-backed tract layer (see layer_store) as typed arrays.
+    """
+    parts = np.asarray(layer["parts"])
+    polygon_features = np.repeat(np.arange(len(parts) - 1), np.diff(parts))
+    blocks = _polygon_blocks(
+        _value_blocks(layer, quantized), layer["colors"], layer["geoids"],
+        layer["vertices"], layer["rings"], layer["polygons"], polygon_features,
+    )
+    return encode_blocks(layer["length"], blocks)
+
+
+def quantize_values(values, dtype=np.uint16):
+    """
+    Quantize float values to unsigned integer codes with a linear scale and
+    offset, NaN becoming the largest code (NODATA for uint16). A value
+    decodes as offset + q * scale, within scale / 2 of the original.
+
+    Returns:
+        quantized: dtype array with the shape of values
+        offset, scale: floats
+    """
+    nodata = np.iinfo(dtype).max
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    if not valid.any():
+        return np.full(values.shape, nodata, dtype=dtype), 0.0, 1.0
+
+    offset = float(values[valid].min())
+    span = float(values[valid].max()) - offset
+    scale = span / (nodata - 1) if span > 0 else 1.0
+
+    quantized = np.full(values.shape, nodata, dtype=dtype)
+    quantized[valid] = np.rint((values[valid] - offset) / scale).astype(dtype)
+    return quantized, offset, scale
+
+
+def dequantize_values(quantized, offset, scale):
+    """
+    Decode quantize_values codes back to floats, NaN for the nodata code.
+    """
+    quantized = np.asarray(quantized)
+    values = offset + quantized.astype(np.float64) * scale
+    values[quantized == np.iinfo(quantized.dtype).max] = np.nan
+    return values
+
+
+def _value_blocks(layer, quantized):
+    """
+    Float32 values, or with quantized=True the layer's pipeline-quantized
+    codes (u1 or u2) plus a quant block (offset, scale, nodata code).
+    """
+    codes = layer.get("quantized") if quantized else None
+    if codes is None:
+        return [("value", _float_array(layer["values"]), 1)]
+    return [
+        ("valueq", np.asarray(codes["codes"]), 1),
+        ("quant", np.array([codes["offset"], codes["scale"], codes["nodata"]], dtype=np.float64), 1),
+    ]
+
+
+def encode_value_cube(cube):
+    """
+    Encode every year of a point variable ({length, years, values (years, n),
+    positions, ids}, and palette and bounds for binned layers) in one payload
+    for client-side animation.
+
+    Blocks:
+        year     u2 (n_years)
+        quant    f8 (offset, scale), value = offset + q * scale
+        value    u2 (n_years * n_points), year-major, NODATA for missing
+        position f32 x2 and id u32, once for every year
+        bound, palette  bin upper bounds (f8) and RGBA colors (u1 x4) of the stored
+                        palette without its transparent entry 0, when the cube has one,
+                        to color like colormap.colors_for_values
+    """
+    quantized, offset, scale = quantize_values(cube["values"])
+    blocks = [
+        ("year", np.array([int(year) for year in cube["years"]], dtype=np.uint16), 1),
+        ("quant", np.array([offset, scale], dtype=np.float64), 1),
+        ("value", quantized.ravel(), 1),
+        ("position", np.asarray(cube["positions"], dtype=np.float32), 2),
+        ("id", np.asarray(cube["ids"], dtype=np.uint32), 1),
+    ]
+    if "palette" in cube:
+        blocks.append(("bound", np.asarray(cube["bounds"], dtype=np.float64), 1))
+        blocks.append(("palette", np.asarray(cube["palette"], dtype=np.uint8)[1:], 4))
+    return encode_blocks(cube["length"], blocks)
+
+
+def encode_layer(layer, quantized=False, palette=False):
+    """
+    Encode any kind of layer returned by Structure.get_points. With
+    quantized=True, layers carrying pipeline-quantized values send those codes,
+    with palette=True point layers send palette indices instead of RGBA.
+    """
+    if "tracts" in layer:
+        return encode_polygon_layer(layer)
+    if "vertices" in layer:
+        return encode_polygon_arrays(layer, quantized)
+    return encode_point_layer(layer, quantized, palette)
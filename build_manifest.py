@@ -0,0 +1,92 @@
+"""
+Build manifest for incremental pipeline runs.
+
+Every output of a writer script is recorded under a key such as
+"write_binary/tmin/1990" together with the fingerprint it was built from:
+hashes of its input files, its threshold/colormap, the consts settings it
+depends on and the source of the code that wrote it. A later run only
+rebuilds the outputs whose fingerprint changed or whose files are gone.
+"""
+
+import hashlib
+import importlib.util
+import json
+import os
+
+from consts import manifest_file
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """
+    sha1 of a file's content.
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def value_hash(value):
+    """
+    sha1 of a JSON-able value such as a threshold list, numpy values included.
+    """
+    encoded = json.dumps(value, sort_keys=True, default=lambda o: o.tolist() if hasattr(o, "tolist") else str(o))
+    return hashlib.sha1(encoded.encode("utf-8")).hexdigest()
+
+
+def code_version(*module_names):
+    """
+    sha1 of the source files of the given modules, the code version of an output.
+    """
+    digest = hashlib.sha1()
+    for name in module_names:
+        spec = importlib.util.find_spec(name)
+        digest.update(name.encode("utf-8"))
+        if spec is not None and spec.origin and os.path.isfile(spec.origin):
+            digest.update(file_hash(spec.origin).encode("ascii"))
+    return digest.hexdigest()
+
+
+class BuildManifest(object):
+    def __init__(self, path=manifest_file) -> None:
+        self.__path = path
+        self.__entries = {}
+
+        if os.path.isfile(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.__entries = json.load(f)
+            except (IOError, json.JSONDecodeError) as e:
+                print(f"Ignoring unreadable build manifest {path}: {e}")
+
+    def entry(self, key):
+        return self.__entries.get(key)
+
+    def is_fresh(self, key, fingerprint, output_path):
+        """
+        True when key was built from the same fingerprint and its output still exists.
+        """
+        entry = self.__entries.get(key)
+        return entry is not None and entry["fingerprint"] == fingerprint and os.path.exists(output_path)
+
+    def record(self, key, fingerprint, **extra):
+        self.__entries[key] = dict(extra, fingerprint=fingerprint)
+
+    def discard(self, key):
+        """
+        Forget key and every key under it, such as "write_binary/tmin" and
+        "write_binary/tmin/1990", so the next run of that writer rebuilds them.
+        """
+        for name in [name for name in self.__entries if name == key or name.startswith(f"{key}/")]:
+            del self.__entries[name]
+
+    def save(self):
+        """
+        Write the manifest atomically, an interrupted run keeps the previous one.
+        """
+        os.makedirs(os.path.dirname(self.__path) or ".", exist_ok=True)
+        tmp_path = f"{self.__path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.__entries, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.__path)
@@ -0,0 +1,110 @@
+import numpy as np
+
+
+def build_threshold_rgba(a, C):
+    """
+    Pair every bin upper bound in a with its color in C as an opaque RGBA tuple.
+    """
+    output = []
+
+    for value, color in zip(a, C):
+        rgba_color = (int(color[0]), int(color[1]), int(color[2]), 255)
+        output.append({"value": value, "color": rgba_color})
+
+    return output
+
+
+def build_color_lut(var_threshold):
+    """
+    Split a threshold list into its sorted bin upper bounds and an RGBA lookup table.
+    """
+    bins = np.array([threshold["value"] for threshold in var_threshold], dtype=float)
+    lut = np.array([threshold["color"] for threshold in var_threshold], dtype=np.uint8).reshape(-1, 4)
+    return bins, lut
+
+
+def classify_values(var_threshold, values):
+    """
+    Return the threshold bin of every value: the first bin whose upper bound is
+    greater than or equal to the value, or the last bin for values above it.
+    """
+    bins, _ = build_color_lut(var_threshold)
+    values = np.asarray(values, dtype=float)
+    return np.minimum(np.searchsorted(bins, values, side='left'), len(bins) - 1)
+
+
+def build_palette(var_threshold):
+    """
+    RGBA palette of a threshold list for bins_for_values: entry 0 is fully
+    transparent, entry i + 1 is the color of bin i.
+    """
+    _, lut = build_color_lut(var_threshold)
+    if len(lut) > 254:
+        raise ValueError(f"Too many threshold bins for a uint8 palette: {len(lut)}")
+    return np.vstack([np.zeros((1, 4), dtype=np.uint8), lut])
+
+
+def palette_bounds(var_threshold):
+    """
+    Bin upper bound of every color of build_palette(var_threshold) after the transparent entry 0.
+    """
+    bins, _ = build_color_lut(var_threshold)
+    return bins
+
+
+def bins_for_values(var_threshold, values):
+    """
+    Palette index (uint8) of every value, so that build_palette(var_threshold)[bins]
+    equals colors_for_values(var_threshold, values).
+    """
+    values = np.asarray(values, dtype=float)
+
+    bins = (classify_values(var_threshold, values) + 1).astype(np.uint8)
+    bins[np.isnan(values) | (values == 0)] = 0
+    return bins
+
+
+def colors_for_values(var_threshold, values):
+    """
+    Color a whole array of values in one call, returning an (n, 4) uint8 RGBA array.
+    Missing (None/NaN) and zero values are fully transparent, values below the
+    first threshold get the first color and values above the last threshold get
+    the last color.
+    """
+    _, lut = build_color_lut(var_threshold)
+    values = np.asarray(values, dtype=float)
+
+    colors = lut[classify_values(var_threshold, values)]
+    colors[np.isnan(values) | (values == 0)] = 0
+    return colors
+
+
+def build_interp_lut(var_threshold, size):
+    """
+    Sample the threshold colors, linearly interpolated over the threshold
+    values, at size evenly spaced values. Returns (low, high, lut) where lut
+    is (size, 4) uint8 RGBA and entry 0 / size - 1 are the colors of low / high.
+    """
+    bins, colors = build_color_lut(var_threshold)
+    samples = np.linspace(bins.min(), bins.max(), size)
+
+    lut = np.empty((size, 4), dtype=np.uint8)
+    for channel in range(4):
+        lut[:, channel] = np.interp(samples, bins, colors[:, channel])
+    return bins.min(), bins.max(), lut
+
+
+def interp_colors_for_values(interp_lut, values):
+    """
+    Color a whole array of values with a build_interp_lut table, returning an
+    (n, 4) uint8 RGBA array. Values outside the table range get the color of
+    the nearest end, missing (NaN) values are fully transparent.
+    """
+    low, high, lut = interp_lut
+    values = np.asarray(values, dtype=float)
+    missing = np.isnan(values)
+
+    position = (np.where(missing, low, values) - low) / (high - low) * (len(lut) - 1)
+    colors = lut[np.clip(np.rint(position), 0, len(lut) - 1).astype(np.intp)]
+    colors[missing] = 0
+    return colors
@@ -10,6 +10,59 @@ files = [
 
 binary_data_dir = f"{files_path}/binary_data"
 
+columnar_data_dir = f"{binary_data_dir}/columnar"
+
+# Fingerprints of the pipeline outputs, see build_manifest.py
+manifest_file = f"{binary_data_dir}/manifest.json"
+
+# Cached point-to-tract spatial joins, see tract_membership.py
+membership_data_dir = f"{binary_data_dir}/membership"
+
+# Tract polygons shared by the tract datasets, one directory per tract set, see layer_store.py
+tract_data_dir = f"{binary_data_dir}/tracts"
+
+risk_file = f"{files_path}/Illinois_prcp_risks_round.feather"
+
+# Return-period columns of the risk file
+risk_properties = [
+    'risk_2yr (', 'risk_5yr (', 'risk_10yr',
+    'risk_25yr', 'risk_50yr', 'risk_100yr',
+    'risk_200yr', 'risk_500yr'
+]
+
+# Cell size in degrees of the grid index used for bounding-box queries
+grid_cell_degrees = 0.1
+
+# Zoom levels of the point layer pyramids and the screen size of their cells
+lod_zoom_levels = [4, 5, 6, 7, 8]
+lod_cell_pixels = 4
+
+# Coverage-simplified tract geometry variants, tolerances in degrees
+polygon_simplify_tolerances = [0.0005, 0.002, 0.008]
+
+# Lazy mode: Structure only catalogs the per-year layers at startup and loads
+# them on first access, keeping at most layer_cache_max_bytes of them
+lazy_layer_loading = False
+layer_cache_max_bytes = 1024 * 1024 * 1024
+
+# Largest decoding error accepted for uint8 value codes, uint16 is used otherwise.
+# The source files are rounded to 0.01, half of that step is not visible.
+quantize_max_error = 0.005
+
+# Entries of the interpolated colormap lookup table of write_binary_interp.py,
+# spanning the threshold range of a variable
+interp_lut_size = 4096
+
+# Upper bound for the encoded layer responses kept in memory by app.py
+response_cache_max_bytes = 512 * 1024 * 1024
+
+# Census tract vector tiles: pre-seeded tiles, the zooms write_bin_polygon.py
+# seeds, the in-memory tile budget and the number of indexed layers kept by app.py
+tiles_data_dir = f"{binary_data_dir}/tiles"
+tile_seed_zoom_levels = list(range(4, 11))
+tile_cache_max_bytes = 256 * 1024 * 1024
+tile_source_cache_size = 8
+
 variables = ["tmin", "tmax", "prcp"]
 
 years = [str(y) for y in range(1980, 2023+1)]
@@ -0,0 +1,53 @@
+import threading
+from collections import OrderedDict
+
+
+class LayerCache(object):
+    """
+    LRU of loaded layers, bounded by the bytes each layer was loaded with.
+    Layers are loaded on first access with a loader returning (layer, nbytes).
+    """
+
+    def __init__(self, max_bytes) -> None:
+        self.__entries = OrderedDict()
+        self.__max_bytes = max_bytes
+        self.__size = 0
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    @property
+    def size(self):
+        return self.__size
+
+    def get(self, key, load):
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None:
+                self.__entries.move_to_end(key)
+                return entry[0]
+
+        # Load outside the lock, a concurrent miss on the same key only loads twice
+        layer, nbytes = load()
+        if layer is None or nbytes > self.__max_bytes:
+            return layer
+
+        with self.__lock:
+            previous = self.__entries.pop(key, None)
+            if previous is not None:
+                self.__size -= previous[1]
+
+            self.__entries[key] = (layer, nbytes)
+            self.__size += nbytes
+
+            # Evict least recently used layers until the budget holds
+            while self.__size > self.__max_bytes:
+                _, (_, evicted_bytes) = self.__entries.popitem(last=False)
+                self.__size -= evicted_bytes
+        return layer
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.__size = 0
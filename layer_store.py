@@ -0,0 +1,526 @@
+"""
+Columnar on-disk layer store.
+
+Point positions and ids never change between years, so every dataset keeps
+one geometry block and one small attribute block per year:
+
+    <columnar_data_dir>/<dataset>/positions.npy          float64 (n, 2)
+                                  ids.npy                uint32  (n,)
+                                  palette.npy            uint8   (n_bins + 1, 4), entry 0 transparent
+                                  bounds.npy             float64 (n_bins,) upper bound of palette entries 1..
+                                  <year>/values.npy      float64 (n,)   NaN for missing
+                                  <year>/bins.npy        uint8   (n,)   palette index
+
+Layers colored without a palette (write_binary_interp.py) keep a
+<year>/colors.npy uint8 (n, 4) instead of bins.npy.
+
+Layers can also carry their values quantized by the pipeline, for the
+compact binary encoding:
+
+    <layer dir>/codes.npy    uint8 or uint16 (n,), largest code for missing
+               /quant.json   dtype, offset, scale, nodata and the measured max_error and rmse
+
+For per-point lookups the same values are also kept point-major, so the
+whole history of one point is a single contiguous row:
+
+    <columnar_data_dir>/<dataset>/series.npy             float64 (n, n_years)
+                                  series_years.npy       uint16  (n_years,)
+
+Level-of-detail pyramids (see lod.py) use the same layout per zoom level,
+plus the cell of every full-resolution point:
+
+    <columnar_data_dir>/<dataset>/lod/<zoom>/positions.npy, ids.npy, palette.npy, members.npy
+                                             <year>/values.npy, bins.npy
+
+Census tract layers keep their flattened polygons once per tract set, under
+a hash of the tract geometries and GEOIDs, shared by every variable:
+
+    <tract_data_dir>/<tract set>/vertices.npy            float64 (n_vertices, 2)
+                                 rings.npy               uint32  first vertex of each ring, + end
+                                 polygons.npy            uint32  first ring of each polygon, + end
+                                 parts.npy               uint32  first polygon of each tract, + end
+                                 ids.npy, geoids.npy
+
+Simplified variants of the tract polygons (see write_bin_polygon.py) keep
+the same tracts and only replace the flattened geometry:
+
+    <tract_data_dir>/<tract set>/simplified/<tolerance>/vertices.npy, rings.npy, polygons.npy, parts.npy
+
+A tract dataset names its tract set, and has one float32 value and one
+color per tract and year:
+
+    <columnar_data_dir>/<prefix>_<var>/tracts.json       {"tracts": "<tract set>"}
+                                       <year>/values.npy float32 (n,)   NaN for tracts without points
+                                       <year>/colors.npy uint8   (n, 4)
+
+<dataset> follows the pickle naming, "<var>" or "<prefix>_<var>". The
+server memory-maps the geometry and series files, so their pages are only
+read when needed and are shared between processes through the OS page
+cache. Every mapping keeps a file descriptor open, so the per-year
+attribute columns, one file per year, field and pyramid level, are read
+into memory instead.
+"""
+
+import json
+import os
+import shutil
+
+import numpy as np
+
+from consts import columnar_data_dir, tract_data_dir
+from binary_format import quantize_values, dequantize_values
+from risk_store import json_numbers
+
+geometry_fields = {
+    "positions": np.float64,
+    "ids": np.uint32,
+}
+attribute_fields = {
+    "values": np.float64,
+    "colors": np.uint8,
+}
+bin_attribute_fields = {
+    "values": np.float64,
+    "bins": np.uint8,
+}
+polygon_geometry_fields = {
+    "vertices": np.float64,
+    "rings": np.uint32,
+    "polygons": np.uint32,
+    "parts": np.uint32,
+    "ids": np.uint32,
+    "geoids": str,
+}
+polygon_shape_fields = {
+    field: polygon_geometry_fields[field] for field in ("vertices", "rings", "polygons", "parts")
+}
+polygon_attribute_fields = {
+    "values": np.float32,
+    "colors": np.uint8,
+}
+column_shapes = {"positions": (-1, 2), "vertices": (-1, 2), "colors": (-1, 4)}
+
+# Fields served for each /pt_layer_data part. The palette is a few hundred
+# bytes and travels with the bins it expands.
+layer_parts = {
+    "geometry": ("length", "positions", "ids"),
+    "attributes": ("length", "values", "quantized", "colors", "bins", "palette"),
+}
+
+# Per-dataset fields that are not indexed by point
+dataset_fields = ("palette", "bounds")
+
+
+def dataset_name(name, prefix=''):
+    return f"{prefix}_{name}" if prefix else name
+
+
+def dataset_dir(name, prefix='', zoom=None):
+    directory = os.path.join(columnar_data_dir, dataset_name(name, prefix))
+    if zoom is not None:
+        directory = os.path.join(directory, "lod", str(zoom))
+    return directory
+
+
+def layer_dir(name, year, prefix='', zoom=None):
+    return os.path.join(dataset_dir(name, prefix, zoom), str(year))
+
+
+def tract_set_dir(tract_set):
+    return os.path.join(tract_data_dir, tract_set)
+
+
+def simplified_dir(tract_set, tolerance):
+    return os.path.join(tract_set_dir(tract_set), "simplified", str(tolerance))
+
+
+def _save_columns(directory, columns, fields):
+    os.makedirs(directory, exist_ok=True)
+
+    for field, dtype in fields.items():
+        column = columns[field]
+        if field == "values" and not isinstance(column, np.ndarray):
+            column = [np.nan if v is None else v for v in column]
+        array = np.asarray(column, dtype=dtype)
+        if field in column_shapes:
+            array = array.reshape(column_shapes[field])
+        np.save(os.path.join(directory, f"{field}.npy"), array)
+
+    return directory
+
+
+def _remove_column(directory, field):
+    # A layer holds either colors or bins, the loader picks bins when both exist
+    path = os.path.join(directory, f"{field}.npy")
+    if os.path.isfile(path):
+        os.remove(path)
+
+
+def _load_columns(directory, fields, mmap_mode='r'):
+    return {
+        field: np.load(os.path.join(directory, f"{field}.npy"), mmap_mode=mmap_mode)
+        for field in fields
+    }
+
+
+def write_point_geometry(positions, ids, name, prefix='', zoom=None, members=None, palette=None, bounds=None):
+    """
+    Save the positions and ids shared by every year of a dataset, or of one
+    of its pyramid levels when zoom is given, the palette its bins index and
+    the bin upper bounds of that palette. Returns the directory.
+    """
+    directory = _save_columns(dataset_dir(name, prefix, zoom), {"positions": positions, "ids": ids}, geometry_fields)
+    if members is not None:
+        np.save(os.path.join(directory, "members.npy"), np.asarray(members, dtype=np.uint32))
+    if palette is not None:
+        np.save(os.path.join(directory, "palette.npy"), np.asarray(palette, dtype=np.uint8).reshape(-1, 4))
+    else:
+        _remove_column(directory, "palette")
+    if palette is not None and bounds is not None:
+        np.save(os.path.join(directory, "bounds.npy"), np.asarray(bounds, dtype=np.float64))
+    else:
+        _remove_column(directory, "bounds")
+    return directory
+
+
+def write_point_series(values, years, name, prefix=''):
+    """
+    Save the point-major (points, years) value matrix of a dataset. Returns the directory.
+    """
+    directory = dataset_dir(name, prefix)
+    os.makedirs(directory, exist_ok=True)
+    np.save(os.path.join(directory, "series.npy"), np.asarray(values, dtype=np.float64))
+    np.save(os.path.join(directory, "series_years.npy"), np.asarray([int(year) for year in years], dtype=np.uint16))
+    return directory
+
+
+def load_point_series(directory):
+    """
+    Memory-map the point-major value matrix of a dataset, (years, series) or None if it was not written.
+    """
+    path = os.path.join(directory, "series.npy")
+    if not os.path.isfile(path):
+        return None
+    years = [str(year) for year in np.load(os.path.join(directory, "series_years.npy"))]
+    return years, np.load(path, mmap_mode='r')
+
+
+def write_point_attributes(values, colors, name, year, prefix='', zoom=None):
+    """
+    Save the values and RGBA colors of one year of a dataset or pyramid level.
+    Returns the layer directory.
+    """
+    _remove_column(layer_dir(name, year, prefix, zoom), "bins")
+    return _save_columns(layer_dir(name, year, prefix, zoom), {"values": values, "colors": colors}, attribute_fields)
+
+
+def write_point_bins(values, bins, name, year, prefix='', zoom=None):
+    """
+    Save the values and palette indices of one year of a dataset or pyramid level.
+    Returns the layer directory.
+    """
+    _remove_column(layer_dir(name, year, prefix, zoom), "colors")
+    return _save_columns(layer_dir(name, year, prefix, zoom), {"values": values, "bins": bins}, bin_attribute_fields)
+
+
+def write_quantized_values(values, directory, max_error):
+    """
+    Save the values of a layer as the narrowest codes (uint8, else uint16)
+    decoding within max_error, and record the measured loss.
+    Returns the quant.json content.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+
+    for dtype in (np.uint8, np.uint16):
+        codes, offset, scale = quantize_values(values, dtype)
+        errors = np.abs(dequantize_values(codes, offset, scale)[valid] - values[valid])
+        max_error_found = float(errors.max()) if errors.size else 0.0
+        if max_error_found <= max_error:
+            break
+
+    quant = {
+        "dtype": np.dtype(dtype).name,
+        "offset": offset,
+        "scale": scale,
+        "nodata": int(np.iinfo(dtype).max),
+        "max_error": max_error_found,
+        "rmse": float(np.sqrt(np.mean(errors ** 2))) if errors.size else 0.0,
+    }
+    os.makedirs(directory, exist_ok=True)
+    np.save(os.path.join(directory, "codes.npy"), codes)
+    with open(os.path.join(directory, "quant.json"), 'w', encoding='utf-8') as f:
+        json.dump(quant, f)
+    return quant
+
+
+def load_quantized(directory):
+    """
+    Load the quantized values of a layer directory, None if they were not written.
+    """
+    quant_path = os.path.join(directory, "quant.json")
+    if not os.path.isfile(quant_path):
+        return None
+    with open(quant_path, 'r', encoding='utf-8') as f:
+        quant = json.load(f)
+    return {
+        "codes": np.load(os.path.join(directory, "codes.npy")),
+        "offset": quant["offset"],
+        "scale": quant["scale"],
+        "nodata": quant["nodata"],
+    }
+
+
+def write_polygon_geometry(vertices, rings, polygons, parts, geoids, tract_set):
+    """
+    Save the flattened polygons of a tract set, shared by every variable and
+    year, and drop its simplified variants. Returns the directory.
+    """
+    columns = {
+        "vertices": vertices, "rings": rings, "polygons": polygons, "parts": parts,
+        "ids": np.arange(len(geoids)), "geoids": geoids,
+    }
+    # Variants of tolerances no longer configured would still be served
+    shutil.rmtree(os.path.join(tract_set_dir(tract_set), "simplified"), ignore_errors=True)
+    return _save_columns(tract_set_dir(tract_set), columns, polygon_geometry_fields)
+
+
+def write_tract_reference(tract_set, name, prefix=''):
+    """
+    Point a tract dataset at the tract set its values are in the order of.
+    Returns the dataset directory.
+    """
+    directory = dataset_dir(name, prefix)
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, "tracts.json"), 'w', encoding='utf-8') as f:
+        json.dump({"tracts": tract_set}, f)
+
+    # Polygons written into the dataset by earlier versions of the pipeline
+    for field in polygon_geometry_fields:
+        _remove_column(directory, field)
+    shutil.rmtree(os.path.join(directory, "simplified"), ignore_errors=True)
+    return directory
+
+
+def write_polygon_attributes(values, colors, name, year, prefix=''):
+    """
+    Save the per-tract values and colors of one year. Returns the layer directory.
+    """
+    return _save_columns(layer_dir(name, year, prefix), {"values": values, "colors": colors}, polygon_attribute_fields)
+
+
+def write_polygon_shapes(vertices, rings, polygons, parts, tract_set, tolerance):
+    """
+    Save a simplified variant of the polygons of a tract set. Returns the directory.
+    """
+    columns = {"vertices": vertices, "rings": rings, "polygons": polygons, "parts": parts}
+    return _save_columns(simplified_dir(tract_set, tolerance), columns, polygon_shape_fields)
+
+
+def is_polygon_dataset(directory):
+    return os.path.isfile(os.path.join(directory, "tracts.json")) or os.path.isfile(os.path.join(directory, "vertices.npy"))
+
+
+def polygon_geometry_dir(directory):
+    """
+    Directory of the tract polygons of a tract dataset directory: its tract
+    set, or the dataset itself when it was written with its own polygons.
+    """
+    reference = os.path.join(directory, "tracts.json")
+    if not os.path.isfile(reference):
+        return directory
+    with open(reference, 'r', encoding='utf-8') as f:
+        return tract_set_dir(json.load(f)["tracts"])
+
+
+def load_polygon_geometry(directory):
+    """
+    Memory-map the flattened tract polygons of a tract set directory.
+    """
+    geometry = _load_columns(directory, polygon_geometry_fields)
+    geometry["length"] = len(geometry["ids"])
+    return geometry
+
+
+def scan_simplified(directory):
+    """
+    Yield (tolerance, shapes) for the simplified variants of a tract set directory.
+    """
+    simplified = os.path.join(directory, "simplified")
+    if not os.path.isdir(simplified):
+        return
+
+    for tolerance in os.listdir(simplified):
+        try:
+            yield float(tolerance), _load_columns(os.path.join(simplified, tolerance), polygon_shape_fields)
+        except (ValueError, IOError) as e:
+            print(f"Failed to load simplified geometry {tolerance} in {directory}: {e}")
+
+
+def load_point_geometry(directory):
+    """
+    Memory-map the geometry block of a dataset directory.
+    """
+    geometry = _load_columns(directory, geometry_fields)
+    geometry["length"] = len(geometry["ids"])
+    if os.path.isfile(os.path.join(directory, "palette.npy")):
+        geometry["palette"] = np.load(os.path.join(directory, "palette.npy"))
+    if os.path.isfile(os.path.join(directory, "bounds.npy")):
+        geometry["bounds"] = np.load(os.path.join(directory, "bounds.npy"))
+    return geometry
+
+
+def load_point_layer(directory, geometry):
+    """
+    Load the attributes of one year and join them with the shared, memory-mapped
+    geometry. Works for tract layers as well, their attributes have the same names.
+    """
+    layer = dict(geometry)
+    fields = bin_attribute_fields if os.path.isfile(os.path.join(directory, "bins.npy")) else attribute_fields
+    layer.update(_load_columns(directory, fields, mmap_mode=None))
+
+    quantized = load_quantized(directory)
+    if quantized is not None:
+        layer["quantized"] = quantized
+    return layer
+
+
+def layer_part(layer, part):
+    """
+    Keep only the fields of a point layer that belong to part ("geometry" or "attributes").
+    """
+    if layer is None or part not in layer_parts:
+        return layer
+    return {field: layer[field] for field in layer_parts[part] if field in layer}
+
+
+def subset_layer(layer, rows):
+    """
+    Keep only the given rows of an array-backed point layer. The ids keep
+    pointing at the original points.
+    """
+    subset = {
+        field: column if field in dataset_fields else column[rows]
+        for field, column in layer.items() if isinstance(column, np.ndarray)
+    }
+    if "quantized" in layer:
+        subset["quantized"] = dict(layer["quantized"], codes=layer["quantized"]["codes"][rows])
+    subset["length"] = len(rows)
+    return subset
+
+
+def layer_colors(layer):
+    """
+    RGBA colors of a point layer, expanded from its palette when it stores bins.
+    """
+    if "bins" in layer:
+        return np.asarray(layer["palette"])[layer["bins"]]
+    return layer["colors"]
+
+
+def scan_store():
+    """
+    Yield (prefix, name, directory, years) for every dataset in the store.
+    """
+    if not os.path.isdir(columnar_data_dir):
+        return
+
+    for dataset in sorted(os.listdir(columnar_data_dir)):
+        parts = dataset.split('_')
+        if len(parts) == 2:
+            prefix, name = parts
+        elif len(parts) == 1:
+            prefix, name = '', parts[0]
+        else:
+            print(f"Unexpected dataset name in columnar store: {dataset}")
+            continue
+
+        directory = os.path.join(columnar_data_dir, dataset)
+        yield prefix, name, directory, list_years(directory)
+
+
+def list_years(directory):
+    return sorted(year for year in os.listdir(directory) if year.isdigit() and os.path.isdir(os.path.join(directory, year)))
+
+
+def scan_levels(directory):
+    """
+    Yield (zoom, level_directory, years) for the pyramid levels of a dataset directory.
+    """
+    lod_dir = os.path.join(directory, "lod")
+    if not os.path.isdir(lod_dir):
+        return
+
+    for zoom in sorted(os.listdir(lod_dir), key=lambda z: int(z) if z.isdigit() else -1):
+        if zoom.isdigit():
+            level_dir = os.path.join(lod_dir, zoom)
+            yield int(zoom), level_dir, list_years(level_dir)
+
+
+def polygon_tracts(layer):
+    """
+    Rebuild the {"tracts": [...]} records of an array-backed tract layer, with
+    GeoJSON-like geometries. Tracts without a value are left out, as before.
+    """
+    vertices = np.asarray(layer["vertices"], dtype=float)
+    rings, polygons, parts = layer["rings"], layer["polygons"], layer["parts"]
+    values = np.asarray(layer["values"])
+    rows = np.nonzero(~np.isnan(values))[0]
+
+    # The stored float32 means are rendered as their shortest decimal, 6.525
+    # rather than the widened 6.525000095367432
+    if values.dtype == np.float32:
+        average_values = [float(literal) for literal in json_numbers(values[rows]).tolist()]
+    else:
+        average_values = values[rows].astype(float).tolist()
+
+    tracts = []
+    for i, average_value in zip(rows, average_values):
+        coordinates = [
+            [vertices[rings[r]:rings[r + 1]].tolist() for r in range(polygons[p], polygons[p + 1])]
+            for p in range(parts[i], parts[i + 1])
+        ]
+        if len(coordinates) == 1:
+            geometry = {"type": "Polygon", "coordinates": coordinates[0]}
+        else:
+            geometry = {"type": "MultiPolygon", "coordinates": coordinates}
+
+        tracts.append({
+            "GEOID": str(layer["geoids"][i]),
+            "average_value": average_value,
+            "color": layer["colors"][i].tolist(),
+            "geometry": geometry,
+        })
+    return tracts
+
+
+def to_json_layer(layer):
+    """
+    Convert an array-backed point layer into the list-based layout the JSON clients expect.
+    Array-backed tract layers become {"tracts": [...]}, other layers are returned unchanged.
+    """
+    if layer is None or "tracts" in layer:
+        return layer
+    if "vertices" in layer:
+        return {"tracts": polygon_tracts(layer)}
+
+    json_layer = {}
+    for field, column in layer.items():
+        if field in ("quantized", "bins", "palette", "bounds"):
+            # Binary encoding only, JSON clients get the expanded colors
+            continue
+        elif field == "length":
+            json_layer[field] = int(column)
+        elif field == "values" and isinstance(column, np.ndarray):
+            values = np.asarray(column, dtype=float)
+            json_values = values.astype(object)
+            json_values[np.isnan(values)] = None
+            json_layer[field] = json_values.tolist()
+        elif isinstance(column, np.ndarray):
+            json_layer[field] = column.ravel().tolist()
+        else:
+            json_layer[field] = column
+
+    if "bins" in layer:
+        json_layer["colors"] = layer_colors(layer).ravel().tolist()
+    return json_layer
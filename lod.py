@@ -0,0 +1,165 @@
+"""
+Level-of-detail pyramids for point layers, and the choice of a simplified
+tract geometry for a zoom level.
+
+For every zoom level in consts.lod_zoom_levels the grid points are binned
+into square Web Mercator cells of lod_cell_pixels x lod_cell_pixels screen
+pixels at that zoom. Each non-empty cell becomes one point:
+
+    position  mean longitude/latitude of the points in the cell
+    id        id of the first original point in the cell, so a click can
+              still be mapped to a real grid point
+    value     mean of the non-missing values of the points in the cell,
+              missing (NaN) when every point in the cell is missing, also
+              kept quantized (see layer_store.write_quantized_values)
+    bin       the palette index of that mean, with the same rules as the
+              full-resolution layer (or its interpolated color for the
+              layers of write_binary_interp.py)
+
+Zoom levels above the last pyramid level are served at full resolution.
+"""
+
+import os
+import shutil
+
+import numpy as np
+
+from colormap import bins_for_values, interp_colors_for_values
+from consts import lod_zoom_levels, lod_cell_pixels, quantize_max_error
+from layer_store import dataset_dir, write_point_geometry, write_point_bins, write_point_attributes, write_quantized_values
+
+TILE_SIZE = 256
+
+
+def cell_size(zoom, cell_pixels):
+    """
+    Cell edge in degrees of longitude (and Mercator-scaled latitude) at a zoom level.
+    """
+    return 360.0 / (TILE_SIZE * 2 ** zoom) * cell_pixels
+
+
+def mercator_y(latitudes):
+    """
+    Web Mercator y in the same degree units as longitude.
+    """
+    lat_rad = np.radians(np.clip(latitudes, -85.05112878, 85.05112878))
+    return np.degrees(np.log(np.tan(np.pi / 4 + lat_rad / 2)))
+
+
+def build_level(positions, zoom, cell_pixels):
+    """
+    Bin points into the cells of one zoom level.
+
+    Returns:
+        members: uint32 (n_points,), cell of every original point
+        level_positions: float64 (n_cells, 2), mean position of each cell
+        level_ids: uint32 (n_cells,), first original point of each cell
+    """
+    positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+    size = cell_size(zoom, cell_pixels)
+
+    cells = np.column_stack((
+        np.floor(positions[:, 0] / size),
+        np.floor(mercator_y(positions[:, 1]) / size),
+    )).astype(np.int64)
+    _, first, members = np.unique(cells, axis=0, return_index=True, return_inverse=True)
+    members = members.ravel()
+
+    counts = np.bincount(members)
+    level_positions = np.column_stack((
+        np.bincount(members, weights=positions[:, 0]) / counts,
+        np.bincount(members, weights=positions[:, 1]) / counts,
+    ))
+    return members.astype(np.uint32), level_positions, first.astype(np.uint32)
+
+
+def aggregate_level(members, n_cells, values):
+    """
+    Mean of the non-missing values of every cell, NaN for cells without any.
+    """
+    values = np.asarray(values, dtype=float)
+    valid = ~np.isnan(values)
+
+    sums = np.bincount(members, weights=np.where(valid, values, 0.0), minlength=n_cells)
+    counts = np.bincount(members, weights=valid, minlength=n_cells)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+
+def select_level(levels, zoom):
+    """
+    Pick the pyramid level for a (possibly fractional) map zoom, None for full resolution.
+    """
+    if not levels:
+        return None
+
+    zoom = int(np.floor(zoom))
+    if zoom > max(levels):
+        return None
+    return max([level for level in levels if level <= zoom], default=min(levels))
+
+
+def pixel_degrees(zoom):
+    """
+    Width of one screen pixel in degrees of longitude at a zoom level.
+    """
+    return cell_size(zoom, 1)
+
+
+def select_tolerance(tolerances, zoom=None, tolerance=None):
+    """
+    Pick the simplified geometry variant for a map zoom or an explicit
+    tolerance in degrees: the coarsest one not above one pixel (or the
+    tolerance). None means full resolution.
+    """
+    if tolerance is None:
+        if zoom is None:
+            return None
+        tolerance = pixel_degrees(zoom)
+    return max([t for t in tolerances if t <= tolerance], default=None)
+
+
+def write_pyramid_geometry(positions, ids, name, prefix='', palette=None):
+    """
+    Build and save the geometry of every pyramid level that is coarser than
+    the full-resolution layer. Returns {zoom: (members, n_cells)}.
+    """
+    levels = {}
+    for zoom in lod_zoom_levels:
+        members, level_positions, first = build_level(positions, zoom, lod_cell_pixels)
+        if len(level_positions) >= len(positions):
+            continue
+
+        write_point_geometry(level_positions, np.asarray(ids)[first], name, prefix, zoom, members, palette)
+        levels[zoom] = (members, len(level_positions))
+
+    # Levels of an earlier run that are no longer configured, or no longer
+    # coarser than the full-resolution layer, would still be served
+    lod_dir = os.path.join(dataset_dir(name, prefix), "lod")
+    if os.path.isdir(lod_dir):
+        for zoom in os.listdir(lod_dir):
+            if not (zoom.isdigit() and int(zoom) in levels):
+                shutil.rmtree(os.path.join(lod_dir, zoom))
+    return levels
+
+
+def write_pyramid_year(levels, values, threshold, name, year, prefix=''):
+    """
+    Aggregate one year of values into every pyramid level and save it,
+    with its quantized values like the full-resolution layer.
+    """
+    for zoom, (members, n_cells) in levels.items():
+        level_values = aggregate_level(members, n_cells, values)
+        directory = write_point_bins(level_values, bins_for_values(threshold, level_values), name, year, prefix, zoom)
+        write_quantized_values(level_values, directory, quantize_max_error)
+
+
+def write_pyramid_interp_year(levels, values, interp_lut, name, year, prefix=''):
+    """
+    Same as write_pyramid_year for layers colored through an interpolated
+    lookup table (see colormap.build_interp_lut) instead of threshold bins.
+    """
+    for zoom, (members, n_cells) in levels.items():
+        level_values = aggregate_level(members, n_cells, values)
+        directory = write_point_attributes(level_values, interp_colors_for_values(interp_lut, level_values), name, year, prefix, zoom)
+        write_quantized_values(level_values, directory, quantize_max_error)
@@ -1,37 +1,32 @@
 import numpy as np
 import json
 from consts import files_path, binary_data_dir
+from layer_store import write_point_geometry, write_point_series
+from point_source import read_point_features
+from lod import write_pyramid_geometry
+from colormap import build_palette, palette_bounds
+from pipeline import run_jobs, report_quantization
+from build_manifest import BuildManifest
+from write_binary import process_year
+from write_gjson_polygon import process_year_geojson
+from tract_membership import load_membership, year_matrix, tract_means
 import pickle
 import os
 from collections import defaultdict
 import geopandas as gpd
 
 
-
 class PickleWriter(object):
     def __init__(self) -> None:
         self.__original_files = []
         self.__bbox_gpd = None
         self.__feature_id = None
 
-    def __get_color_for_value(self, var_threshold, value):
-        """
-        Given a value and a list of thresholds, return the corresponding color.
-        If the value is non-numeric, return a fully transparent color.
-        If the value is below the first threshold, return the first color.
-        If the value is above the last threshold, return the last color.
-        """
-        if not isinstance(value, (int, float)) or value == 0:
-            # Fully transparent
-            return (0, 0, 0, 0)
-        
-        for threshold in var_threshold:
-            if value <= threshold["value"]:
-                return threshold["color"]
-        # If value exceeds all var_threshold, return the last color
-        return var_threshold[-1]["color"]
-
-    def __process_points(self):
+    def __process_points(self, workers):
+        jobs = []
+        shared = {}
+        manifest = BuildManifest()
+
         for file in self.__original_files:
             var_name = file["var_name"]
             file_path = file["path"]
@@ -69,72 +64,34 @@ class PickleWriter(object):
 
             print(f"Processing variable '{var_name}' for years: {', '.join(years)}")
 
-            for year in years:
-                positions = []
-                colors = []
-                values = []  # New list to store values
-                ids = []  # List to store IDs
-                processed_features = 0
-                point_id = 0  # Initialize ID counter
-
-                for feature in features:
-                    coord = feature.get("geometry", {}).get("coordinates", [])
-                    if not coord or len(coord) < 2:
-                        print(f"Invalid coordinates in feature: {feature}. Skipping feature.")
-                        continue
-
-                    properties = feature.get("properties", {})
-
-                    # Retrieve the value for the current year
-                    raw_value = properties.get(year)
-
-                    # Convert raw_value to float, handle errors
-                    if raw_value is None:
-                        value = None  # Will be handled as transparent
-                    else:
-                        try:
-                            value = float(raw_value)
-                        except (ValueError, TypeError):
-                            print(f"Warning: Unable to convert value '{raw_value}' to float for feature with properties {properties}")
-                            value = None  # Will be handled as transparent
-
-                    # Get the color based on the value and thresholds
-                    try:
-                        r, g, b, a = self.__get_color_for_value(file["threshold"], value)
-                    except ValueError as e:
-                        print(f"Error converting color for value {value}: {e}")
-                        r, g, b, a = (0, 0, 0, 0)  # Fully transparent as fallback
-
-                    # Append data
-                    positions.extend([coord[0], coord[1]])
-                    colors.extend([r, g, b, a])
-                    values.append(value)  # Store the value
-                    ids.append(point_id)  # Add the current point ID
-                    point_id += 1  # Increment ID counter
-                    processed_features += 1
-
-                # Prepare the binary data
-                binary_data = {
-                    "length": processed_features,
-                    "positions": positions,
-                    "colors": colors,
-                    "values": values,
-                    "ids": ids
-                }
-
-                # Define the filename
-                filename = f"{var_name}_{year}.pickle"
-                filepath = os.path.join(binary_data_dir, filename)
-
-                # Save the binary data using pickle
-                try:
-                    with open(filepath, 'wb') as pf:
-                        pickle.dump(binary_data, pf)
-                    print(f"Saved binary data for {var_name} {year} to {filepath}")
-                except IOError as e:
-                    print(f"Failed to save binary data to {filepath}: {e}")
+            # Walk the features once, positions and ids are the same for every year
+            positions, values = read_point_features(features, years)
+            ids = np.arange(len(positions), dtype=np.uint32)  # Sequential point IDs
+
+            try:
+                filepath = write_point_geometry(positions, ids, var_name, palette=build_palette(file["threshold"]), bounds=palette_bounds(file["threshold"]))
+                levels = write_pyramid_geometry(positions, ids, var_name, palette=build_palette(file["threshold"]))
+                write_point_series(values, years, var_name)
+                print(f"Saved geometry and {len(levels)} pyramid levels for {var_name} to {filepath}")
+            except IOError as e:
+                print(f"Failed to save geometry for {var_name}: {e}")
+                continue
+
+            # The outputs of write_binary.py are being replaced
+            manifest.discard(f"write_binary/{var_name}")
+            manifest.save()
+
+            shared[var_name] = {"values": values, "years": years, "levels": levels, "threshold": file["threshold"]}
+            jobs.extend((var_name, year) for year in years)
+
+        # Fan the (var_name, year) work units out to the write_binary.py worker, the value matrices are shared read-only
+        results = run_jobs(process_year, jobs, shared, workers)
+        report_quantization(jobs, results)
     
-    def __process_polygons(self):
+    def __process_polygons(self, workers):
+        jobs = []
+        shared = {"tracts": self.__bbox_gpd, "feature_id": self.__feature_id, "points": {}}
+
         for file in self.__original_files:
             var_name = file["var_name"]
             file_path = file["path"]
@@ -171,58 +128,27 @@ class PickleWriter(object):
 
             print(f"Processing variable '{var_name}' for years: {', '.join(years)}")
 
-            for year in years:
-                # Select the value column for the current year
-                if year not in points_gdf.columns:
-                    print(f"Year '{year}' not found in {file_path}. Skipping year.")
-                    continue
-
-                # Create a GeoDataFrame with only necessary columns
-                df_year = points_gdf[['geometry', year]].copy()
-                df_year = df_year.dropna(subset=[year])
-
-                # Spatial join with tracts to assign each point to a tract
-                try:
-                    joined = gpd.sjoin(df_year, self.__bbox_gpd, how='inner', predicate='within')
-                except Exception as e:
-                    print(f"Error during spatial join for {var_name} {year}: {e}")
-                    continue
-
-                # Group by tract and compute average
-                grouped = joined.groupby(self.__feature_id)[year].mean().reset_index()
-                grouped.rename(columns={year: 'average_value'}, inplace=True)
-
-                # Assign colors based on average values
-                grouped['color'] = grouped['average_value'].apply(lambda x: self.__get_color_for_value(file["threshold"], x))
-
-                # Merge with bbox_gpd to get geometries
-                grouped = grouped.merge(self.__bbox_gpd[[self.__feature_id, 'geometry']], on=self.__feature_id, how='left')
-
-                # Convert to GeoDataFrame
-                geojson_gdf = gpd.GeoDataFrame(grouped, geometry='geometry')
-
-                # Define properties for GeoJSON
-                geojson_gdf['color'] = geojson_gdf['color'].apply(lambda c: f"rgba({c[0]}, {c[1]}, {c[2]}, {c[3]})")
-                geojson_gdf = geojson_gdf[[self.__feature_id, 'average_value', 'color', 'geometry']]
-
-                # Define the filename
-                filename = f"ct_{var_name}_{year}.geojson"
-                filepath = os.path.join(binary_data_dir, filename)
-
-                # Save to GeoJSON
-                try:
-                    geojson_gdf.to_file(filepath, driver='GeoJSON')
-                    print(f"Saved GeoJSON data for {var_name} {year} to {filepath}")
-                except IOError as e:
-                    print(f"Failed to save GeoJSON data to {filepath}: {e}")
+            # Assign points to tracts once, then average every year in one pass
+            try:
+                point_rows, tract_rows = load_membership(points_gdf, self.__bbox_gpd)
+            except Exception as e:
+                print(f"Error during spatial join for {var_name}: {e}. Skipping {var_name}.")
+                continue
+            means = tract_means(point_rows, tract_rows, len(self.__bbox_gpd), year_matrix(points_gdf, years))
+
+            shared["points"][var_name] = {"means": means, "years": years, "path": file_path, "threshold": file["threshold"]}
+            jobs.extend((var_name, year) for year in years)
+
+        # Fan the (var_name, year) work units out to the write_gjson_polygon.py worker, tract means and tracts are shared read-only
+        run_jobs(process_year_geojson, jobs, shared, workers)
     
-    def process_file(self):
+    def process_file(self, workers=1):
 
-        if self.__bbox_gpd != None and self.__feature_id != None:
-            self.__process_polygons()
+        if self.__bbox_gpd is not None and self.__feature_id is not None:
+            self.__process_polygons(workers)
 
         else:
-            self.__process_points()
+            self.__process_points(workers)
 
     def reset_obj(self):
         self.__original_files = []
@@ -0,0 +1,67 @@
+import multiprocessing as mp
+import os
+from collections import defaultdict
+
+import numpy as np
+
+# Read-only input of the running job batch. It is installed before the pool
+# forks, so workers read it copy-on-write instead of receiving a pickled copy.
+_shared = {}
+
+
+def get_shared(key):
+    return _shared[key]
+
+
+def resolve_workers(workers):
+    """
+    Number of worker processes for a --workers value, 0 meaning one per core.
+    """
+    if workers is None or workers < 0:
+        return 1
+    return workers or os.cpu_count() or 1
+
+
+def run_jobs(worker, jobs, shared=None, workers=1):
+    """
+    Run worker(job) for every job and return the results in job order.
+
+    Parameters:
+        worker: module-level function taking one job, e.g. a (var_name, year) tuple
+        jobs: list of jobs
+        shared: dict of read-only inputs the worker reads through get_shared
+        workers: number of processes, 1 runs the jobs in this process
+    """
+    _shared.clear()
+    _shared.update(shared or {})
+
+    workers = min(resolve_workers(workers), len(jobs))
+    try:
+        if workers <= 1 or "fork" not in mp.get_all_start_methods():
+            return [worker(job) for job in jobs]
+
+        with mp.get_context("fork").Pool(workers) as pool:
+            return pool.map(worker, jobs, chunksize=1)
+    finally:
+        _shared.clear()
+
+
+def add_workers_argument(parser):
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='Worker processes for the (variable, year) jobs, 0 for one per core.')
+
+
+def report_quantization(jobs, results):
+    """
+    Print the quantization loss of the rebuilt layers, per variable.
+    """
+    by_variable = defaultdict(list)
+    for (var_name, _), quant in zip(jobs, results):
+        if quant is not None:
+            by_variable[var_name].append(quant)
+
+    for var_name, quants in by_variable.items():
+        dtypes = sorted(set(quant["dtype"] for quant in quants))
+        max_error = max(quant["max_error"] for quant in quants)
+        rmse = float(np.sqrt(np.mean([quant["rmse"] ** 2 for quant in quants])))
+        print(f"Quantized {var_name}: {len(quants)} layers as {'/'.join(dtypes)}, max error {max_error:.6g}, rmse {rmse:.6g}")
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+
+
+def read_point_features(features, years):
+    """
+    Walk the GeoJSON point features once and fan every year out into a matrix.
+
+    Parameters:
+        features: list of GeoJSON point features
+        years: year property names, one matrix column each
+
+    Returns:
+        positions: float64 (n_points, 2) longitude/latitude
+        values: float64 (n_points, n_years), NaN for missing or non-numeric values
+    """
+    positions = []
+    properties = []
+
+    for feature in features:
+        coord = feature.get("geometry", {}).get("coordinates", [])
+        if not coord or len(coord) < 2:
+            print(f"Invalid coordinates in feature: {feature}. Skipping feature.")
+            continue
+
+        positions.append((coord[0], coord[1]))
+        properties.append(feature.get("properties", {}))
+
+    # Parse every year column in one vectorized pass
+    raw = pd.DataFrame(properties, columns=years)
+    parsed = raw.apply(pd.to_numeric, errors='coerce')
+
+    n_invalid = int((parsed.isna() & raw.notna()).to_numpy().sum())
+    if n_invalid:
+        print(f"Warning: Unable to convert {n_invalid} values to float. They will be transparent.")
+
+    return (
+        np.asarray(positions, dtype=np.float64).reshape(-1, 2),
+        parsed.to_numpy(dtype=np.float64).reshape(len(positions), len(years)),
+    )
@@ -7,7 +7,7 @@ import pickle
 import os
 from collections import defaultdict
 
-from write_bin_polygon import build_threshold_rgba
+from colormap import build_threshold_rgba
 
 def write_pickle_files():
     temp_threshold = build_threshold_rgba(temp_range, temp_colors)
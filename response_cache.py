@@ -0,0 +1,64 @@
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+
+CachedResponse = namedtuple("CachedResponse", ["body", "mimetype", "etag"])
+
+
+class ResponseCache(object):
+    """
+    LRU cache of encoded response bodies, bounded by their total size in bytes.
+    Every entry carries a strong ETag computed from its body.
+    """
+
+    def __init__(self, max_bytes) -> None:
+        self.__entries = OrderedDict()
+        self.__max_bytes = max_bytes
+        self.__size = 0
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    @property
+    def size(self):
+        return self.__size
+
+    @staticmethod
+    def entry(body, mimetype):
+        return CachedResponse(body, mimetype, hashlib.sha1(body).hexdigest())
+
+    def get(self, key):
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None:
+                self.__entries.move_to_end(key)
+            return entry
+
+    def put(self, key, body, mimetype):
+        """
+        Store an encoded body and return its CachedResponse. Bodies larger than
+        the whole budget are returned without being cached.
+        """
+        entry = self.entry(body, mimetype)
+        if len(body) > self.__max_bytes:
+            return entry
+
+        with self.__lock:
+            previous = self.__entries.pop(key, None)
+            if previous is not None:
+                self.__size -= len(previous.body)
+
+            self.__entries[key] = entry
+            self.__size += len(body)
+
+            # Evict least recently used bodies until the budget holds
+            while self.__size > self.__max_bytes:
+                _, evicted = self.__entries.popitem(last=False)
+                self.__size -= len(evicted.body)
+        return entry
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.__size = 0
@@ -0,0 +1,128 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+from spatial_index import SphereIndex
+
+
+def json_numbers(values):
+    """
+    JSON literals of float32 values: the shortest decimal that reads back as
+    the same float32, so 1.23 stays "1.23" instead of 1.2300000190734863.
+    Missing (NaN) values become "null".
+    """
+    values = np.asarray(values, dtype=np.float32)
+    literals = values.astype(str)
+    literals[np.isnan(values)] = "null"
+    return literals
+
+
+class RiskStore(object):
+    """
+    Return-period risks of every site as one contiguous float32
+    (n_sites, n_periods) array. A site index resolves to its row positionally
+    for a RangeIndex, or by binary search over the sorted site indices, so
+    there is no per-site Python object to dirty shared pages after fork.
+    The /risk_data body is rendered from a template built at load time.
+    """
+
+    def __init__(self, df, properties) -> None:
+        self.__values = np.ascontiguousarray(df[properties].to_numpy(dtype=np.float32))
+        self.__sites = df.index.to_numpy()
+
+        self.__range = None
+        if isinstance(df.index, pd.RangeIndex):
+            self.__range = (df.index.start, df.index.step)
+        else:
+            self.__order = np.argsort(self.__sites, kind='stable')
+            self.__sorted_sites = self.__sites[self.__order]
+        self.__periods = [re.search(r'\d+', column).group() for column in properties]
+
+        self.__index = None
+        if 'latitude' in df.columns and 'longitude' in df.columns:
+            # Build the nearest-point index once instead of scanning every row per lookup
+            self.__index = SphereIndex(df['latitude'].to_numpy(dtype=float), df['longitude'].to_numpy(dtype=float))
+
+        # [{"year": "<period>", "value": <value>}, ...] split around the values
+        fields = [f'{{"year": "{period}", "value": ' for period in self.__periods]
+        self.__template = "[" + "%s}, ".join(fields) + "%s}]"
+
+    def __len__(self):
+        return len(self.__values)
+
+    @property
+    def periods(self):
+        return self.__periods
+
+    @property
+    def has_index(self):
+        return self.__index is not None
+
+    def row(self, site):
+        """
+        Row of a site index, None when it does not exist.
+        """
+        if self.__range is not None:
+            start, step = self.__range
+            row, remainder = divmod(site - start, step)
+            return row if remainder == 0 and 0 <= row < len(self.__values) else None
+
+        try:
+            row = int(self.rows([site])[0])
+        except OverflowError:
+            return None
+        return None if row < 0 else row
+
+    def rows(self, sites):
+        """
+        Rows of many site indices, -1 for the missing ones.
+        """
+        sites = np.asarray(sites, dtype=np.int64)
+        if self.__range is not None:
+            start, step = self.__range
+            rows, remainder = np.divmod(sites - start, step)
+            found = (remainder == 0) & (rows >= 0) & (rows < len(self.__values))
+        else:
+            positions = np.minimum(np.searchsorted(self.__sorted_sites, sites), len(self.__sorted_sites) - 1)
+            found = self.__sorted_sites[positions] == sites if len(self.__sorted_sites) else np.zeros(len(sites), dtype=bool)
+            rows = self.__order[positions] if len(self.__sorted_sites) else positions
+        return np.where(found, rows, -1).astype(np.int64)
+
+    def nearest(self, lat, lon):
+        return self.__index.nearest(lat, lon)
+
+    def nearest_many(self, lats, lons):
+        return self.__index.nearest_many(lats, lons)
+
+    def sites(self, rows):
+        """
+        Site index of every row, None for -1.
+        """
+        rows = np.asarray(rows)
+        return np.where(rows >= 0, self.__sites[np.where(rows >= 0, rows, 0)], None)
+
+    def values(self, rows):
+        """
+        (n_periods, n_rows) table of JSON-ready floats, None for missing rows and values.
+        """
+        rows = np.asarray(rows)
+        found = rows >= 0
+        table = np.full((len(rows), len(self.__periods)), np.nan, dtype=np.float32)
+        table[found] = self.__values[rows[found]]
+
+        literals = json_numbers(table.T)
+        return [[None if v == "null" else float(v) for v in period] for period in literals.tolist()]
+
+    def records(self, row):
+        """
+        [{"year": period, "value": value}, ...] of one row.
+        """
+        values = [None if v == "null" else float(v) for v in json_numbers(self.__values[row]).tolist()]
+        return [{"year": period, "value": value} for period, value in zip(self.__periods, values)]
+
+    def render(self, row):
+        """
+        The JSON body of records(row), without building the records.
+        """
+        return self.__template % tuple(json_numbers(self.__values[row]).tolist())
@@ -0,0 +1,66 @@
+"""
+Production entry point: load the datasets once, then fork N gunicorn workers.
+
+    python serve.py -w 8 -b 0.0.0.0:5000
+
+With preload the app module and every dataset are loaded in the master
+before fork, and the workers share those pages copy-on-write. Layers are
+.npy arrays, memory-mapped or read whole, and the risk table is one float32
+array (see risk_store.py), so there are few Python objects whose refcounts
+would dirty shared pages.
+gc.freeze() moves whatever was loaded out of the collector's reach, so
+collections in the workers don't write to those pages either.
+
+Every memory-mapped .npy file holds a file descriptor, so the workers use
+the gthread worker (epoll instead of select, which stops at fd 1024) and
+load_data() raises the open-file limit to its hard limit.
+"""
+
+import argparse
+import gc
+import os
+
+from gunicorn.app.base import BaseApplication
+
+from app import app, load_data
+
+
+class PreforkServer(BaseApplication):
+    def __init__(self, application, options) -> None:
+        self.__application = application
+        self.__options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.__options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        return self.__application
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the app with pre-forked workers.')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1, help='Number of worker processes.')
+    parser.add_argument('-t', '--threads', type=int, default=1, help='Threads per worker.')
+    parser.add_argument('-b', '--bind', type=str, default='127.0.0.1:5000', help='Address to bind.')
+    args = parser.parse_args()
+
+    # Load in the master, before fork
+    load_data()
+    gc.collect()
+    gc.freeze()
+
+    options = {
+        "bind": args.bind,
+        "workers": args.workers,
+        "threads": args.threads,
+        "preload_app": True,
+        "worker_class": "gthread",
+    }
+    print(f"Serving with {args.workers} workers on {args.bind}")
+    PreforkServer(app, options).run()
+
+
+if __name__ == '__main__':
+    main()
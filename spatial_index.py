@@ -0,0 +1,129 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+def haversine_distance(lat1, lon1, lat2, lon2):
+    """
+    Calculate the great-circle distance between two points on the Earth surface.
+
+    Parameters:
+        lat1, lon1: Latitude and Longitude of point 1 in decimal degrees
+        lat2, lon2: Latitude and Longitude of point 2 in decimal degrees
+
+    Returns:
+        Distance in meters
+    """
+    # Earth radius in meters
+    R = 6371000
+
+    # Convert decimal degrees to radians
+    lat1_rad, lon1_rad = np.radians(lat1), np.radians(lon1)
+    lat2_rad, lon2_rad = np.radians(lat2), np.radians(lon2)
+
+    # Haversine formula
+    dlat = lat2_rad - lat1_rad
+    dlon = lon2_rad - lon1_rad
+    a = np.sin(dlat / 2.0)**2 + np.cos(lat1_rad) * np.cos(lat2_rad) * np.sin(dlon / 2.0)**2
+    c = 2 * np.arcsin(np.sqrt(a))
+    distance = R * c
+    return distance
+
+
+def to_unit_sphere(latitudes, longitudes):
+    """
+    Convert latitude/longitude in decimal degrees to (x, y, z) on the unit sphere.
+    The straight-line (chord) distance between two of these points grows
+    monotonically with their great-circle distance.
+    """
+    lat_rad = np.radians(np.asarray(latitudes, dtype=float))
+    lon_rad = np.radians(np.asarray(longitudes, dtype=float))
+    cos_lat = np.cos(lat_rad)
+    return np.column_stack((cos_lat * np.cos(lon_rad), cos_lat * np.sin(lon_rad), np.sin(lat_rad)))
+
+
+class SphereIndex(object):
+    """
+    KD-tree over unit-sphere coordinates answering nearest-point queries in
+    O(log N). A handful of chord-nearest candidates are re-ranked with the
+    haversine formula, so the answer is the same row np.argmin over the
+    haversine distances of every point would pick (lowest row on ties).
+    """
+
+    def __init__(self, latitudes, longitudes, candidates=8) -> None:
+        self.__latitudes = np.asarray(latitudes, dtype=float)
+        self.__longitudes = np.asarray(longitudes, dtype=float)
+        self.__tree = cKDTree(to_unit_sphere(self.__latitudes, self.__longitudes))
+        self.__candidates = max(1, min(candidates, len(self.__latitudes)))
+
+    def __len__(self):
+        return len(self.__latitudes)
+
+    def nearest_many(self, lats, lons):
+        """
+        Return the row position of the nearest point for each (lat, lon) pair.
+        """
+        lats = np.atleast_1d(np.asarray(lats, dtype=float))
+        lons = np.atleast_1d(np.asarray(lons, dtype=float))
+        if len(lats) == 0:
+            return np.empty(0, dtype=np.int64)
+
+        _, candidates = self.__tree.query(to_unit_sphere(lats, lons), k=self.__candidates)
+        candidates = np.sort(candidates.reshape(len(lats), -1), axis=1)
+
+        distances = haversine_distance(
+            lats[:, None], lons[:, None],
+            self.__latitudes[candidates], self.__longitudes[candidates]
+        )
+        return candidates[np.arange(len(lats)), np.argmin(distances, axis=1)]
+
+    def nearest(self, lat, lon):
+        """
+        Return the row position of the point nearest to (lat, lon).
+        """
+        return int(self.nearest_many(lat, lon)[0])
+
+
+class GridIndex(object):
+    """
+    Uniform longitude/latitude grid over point positions. Points are sorted by
+    cell, row by row, so the cells of one grid row that overlap a bounding box
+    are a single contiguous slice.
+    """
+
+    def __init__(self, positions, cell_size=0.1) -> None:
+        self.__positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        self.__cell_size = float(cell_size)
+
+        if len(self.__positions):
+            self.__origin = self.__positions.min(axis=0)
+        else:
+            self.__origin = np.zeros(2)
+
+        cells = np.floor((self.__positions - self.__origin) / self.__cell_size).astype(np.int64)
+        self.__shape = cells.max(axis=0) + 1 if len(cells) else np.ones(2, dtype=np.int64)
+
+        cell_ids = cells[:, 1] * self.__shape[0] + cells[:, 0]
+        self.__order = np.argsort(cell_ids, kind='stable')
+        self.__cell_starts = np.searchsorted(cell_ids[self.__order], np.arange(self.__shape[0] * self.__shape[1] + 1))
+
+    def query(self, min_lon, min_lat, max_lon, max_lat):
+        """
+        Return the sorted row positions of the points inside the bounding box.
+        """
+        low = np.floor((np.array([min_lon, min_lat]) - self.__origin) / self.__cell_size).astype(np.int64)
+        high = np.floor((np.array([max_lon, max_lat]) - self.__origin) / self.__cell_size).astype(np.int64)
+        if np.any(high < 0) or np.any(low >= self.__shape) or np.any(low > high):
+            return np.empty(0, dtype=np.int64)
+
+        low = np.maximum(low, 0)
+        high = np.minimum(high, self.__shape - 1)
+
+        candidates = np.concatenate([
+            self.__order[self.__cell_starts[row * self.__shape[0] + low[0]]:self.__cell_starts[row * self.__shape[0] + high[0] + 1]]
+            for row in range(low[1], high[1] + 1)
+        ])
+
+        # Cells on the edge of the box are only partly inside
+        lon, lat = self.__positions[candidates, 0], self.__positions[candidates, 1]
+        inside = (lon >= min_lon) & (lon <= max_lon) & (lat >= min_lat) & (lat <= max_lat)
+        return np.sort(candidates[inside])
@@ -1,17 +1,39 @@
-from consts import binary_data_dir
+from consts import binary_data_dir, risk_file, risk_properties, grid_cell_degrees, lazy_layer_loading, layer_cache_max_bytes
 import pickle
 import os
 from collections import defaultdict
+from functools import partial
 import pandas as pd
-import re
 from geopy.distance import geodesic
 import numpy as np
 from scipy.spatial.distance import cdist
+from spatial_index import SphereIndex, GridIndex, haversine_distance
+from layer_store import scan_store, scan_levels, load_point_geometry, load_point_layer, subset_layer, is_polygon_dataset, polygon_geometry_dir, load_polygon_geometry, scan_simplified, load_point_series, geometry_fields
+from lod import select_level, select_tolerance
+from layer_cache import LayerCache
+from risk_store import RiskStore
+
+def load_pickle_layer(file_path):
+    with open(file_path, 'rb') as f:
+        return pickle.load(f), os.path.getsize(file_path)
+
+def load_columnar_layer(directory, geometry):
+    layer = load_point_layer(directory, geometry)
+    return layer, sum(column.nbytes for field, column in layer.items() if isinstance(column, np.ndarray) and field not in geometry_fields)
 
 class Structure(object):
-    def __init__(self) -> None:
+    def __init__(self, lazy=lazy_layer_loading, cache_max_bytes=layer_cache_max_bytes) -> None:
+        # In lazy mode the per-year entries are loaders, resolved through the layer cache
+        self.__lazy = lazy
+        self.__layers = LayerCache(cache_max_bytes)
         self.__binary = {}
-        self.__risk_df = None
+        self.__geometry = {}
+        self.__grid = {}
+        self.__lod = {}
+        self.__simplified = {}
+        self.__series = {}
+        self.__series_index = {}
+        self.__risk = None
     
     
     def load_points(self, file_group, prefix=''):
@@ -35,9 +57,11 @@ class Structure(object):
                         name, year = parts
                     
                     file_path = os.path.join(binary_data_dir, filename)
-                    with open(file_path, 'rb') as f:
-                        data = pickle.load(f)
-                    
+                    if self.__lazy:
+                        data_dict[name][year] = partial(load_pickle_layer, file_path)
+                        continue
+
+                    data, _ = load_pickle_layer(file_path)
                     data_dict[name][year] = data
 
                 except Exception as e:
@@ -46,7 +70,7 @@ class Structure(object):
         return data_dict
     
     def load_binary(self):
-        all_files = [f for f in os.listdir(binary_data_dir) if f.endswith('.pickle')]
+        all_files = [f for f in os.listdir(binary_data_dir) if f.endswith('.pickle')] if os.path.isdir(binary_data_dir) else []
         groups = defaultdict(list)
         
         for filename in all_files:
@@ -68,8 +92,76 @@ class Structure(object):
             print(f"Processing group with prefix '{prefix}' containing {len(file_group)} files.")
             group_data = self.load_points(file_group, prefix)
             all_data[prefix] = group_data
+
+        # Columnar geometry is memory-mapped, the small per-year columns are read into memory.
+        # Every year of a dataset shares the same positions and ids arrays.
+        all_geometry = {}
+        all_grid = {}
+        all_lod = {}
+        all_simplified = {}
+        all_series = {}
+        # Tract datasets of the same tract set share one mapping of its polygons
+        tract_sets = {}
+        n_columnar = 0
+        for prefix, name, directory, years in scan_store():
+            polygons = is_polygon_dataset(directory)
+            try:
+                if polygons:
+                    tracts_dir = polygon_geometry_dir(directory)
+                    if tracts_dir not in tract_sets:
+                        tract_sets[tracts_dir] = (load_polygon_geometry(tracts_dir), dict(scan_simplified(tracts_dir)))
+                    geometry, simplified = tract_sets[tracts_dir]
+                else:
+                    geometry = load_point_geometry(directory)
+            except Exception as e:
+                print(f"Failed to load geometry in {directory}: {e}")
+                continue
+            all_geometry.setdefault(prefix, {})[name] = geometry
+            if polygons:
+                all_simplified.setdefault(prefix, {})[name] = simplified
+            else:
+                all_grid.setdefault(prefix, {})[name] = GridIndex(geometry["positions"], grid_cell_degrees)
+                series = load_point_series(directory)
+                if series is not None:
+                    all_series.setdefault(prefix, {})[name] = series
+
+            for year in years:
+                if self.__lazy:
+                    all_data.setdefault(prefix, defaultdict(dict))[name][year] = partial(load_columnar_layer, os.path.join(directory, year), geometry)
+                    continue
+                try:
+                    layer = load_point_layer(os.path.join(directory, year), geometry)
+                except Exception as e:
+                    print(f"Failed to load {directory}/{year}: {e}")
+                    continue
+                all_data.setdefault(prefix, defaultdict(dict))[name][year] = layer
+                n_columnar += 1
+
+            # Coarser pyramid levels for low zoom
+            for zoom, level_dir, level_years in scan_levels(directory):
+                try:
+                    level_geometry = load_point_geometry(level_dir)
+                    if self.__lazy:
+                        level_layers = {year: partial(load_columnar_layer, os.path.join(level_dir, year), level_geometry) for year in level_years}
+                    else:
+                        level_layers = {year: load_point_layer(os.path.join(level_dir, year), level_geometry) for year in level_years}
+                except Exception as e:
+                    print(f"Failed to load pyramid level {level_dir}: {e}")
+                    continue
+                all_lod.setdefault(prefix, {}).setdefault(name, {})[zoom] = {"geometry": level_geometry, "layers": level_layers}
+        if self.__lazy:
+            print(f"Cataloged {sum(len(years) for names in all_data.values() for years in names.values())} layers for lazy loading.")
+        else:
+            print(f"Loaded {n_columnar} columnar layers.")
         
         self.__binary = all_data
+        self.__geometry = all_geometry
+        self.__grid = all_grid
+        self.__lod = all_lod
+        self.__simplified = all_simplified
+        self.__series = all_series
+        self.__series_index = {}
+        self.__layers.clear()
         print(all_data.keys())
         # return all_data
     
@@ -92,22 +184,148 @@ class Structure(object):
                     print(f"Failed to load {filename}: {e}")
         self.__binary = data_dict
 
-    def load_risk(self):
-        feather_file = "./files/Illinois_prcp_risks_round.feather"
-        df = pd.read_feather(feather_file)
-        self.__risk_df = df
-
-        if 'latitude' in self.__risk_df.columns and 'longitude' in self.__risk_df.columns:
-            self.__risk_df['latitude'] = self.__risk_df['latitude'].astype(float)
-            self.__risk_df['longitude'] = self.__risk_df['longitude'].astype(float)
+    def load_risk(self, feather_file=risk_file):
+        # The frame is only read once, lookups go to the contiguous float32 array
+        self.__risk = RiskStore(pd.read_feather(feather_file), risk_properties)
     
-    def get_points(self, name, year, s_agg):
+    def get_value_cube(self, name, s_agg):
+        """
+        Every year of a point dataset as one (years, points) value matrix,
+        with the shared positions and ids, and its palette and bin bounds.
+        """
+        geometry = self.get_point_geometry(name, s_agg)
+        layers = self.__binary.get(s_agg, {}).get(name)
+        if geometry is None or not layers:
+            return None
+
+        years = sorted(layers)
+        cube = {
+            "length": geometry["length"],
+            "years": years,
+            "values": np.stack([self.__resolve((s_agg, name, year, None), layers[year])["values"] for year in years]),
+            "positions": geometry["positions"],
+            "ids": geometry["ids"],
+        }
+        # The palette the layers were binned with, absent for interpolated colors
+        if "palette" in geometry and "bounds" in geometry:
+            cube["palette"], cube["bounds"] = geometry["palette"], geometry["bounds"]
+        return cube
+
+    def get_point_series(self, pt_idx=None, lat=None, lon=None, s_agg=''):
+        """
+        The full yearly series of one point for every variable, read as one
+        row of each point-major matrix. The point is either a point id or the
+        grid point nearest to (lat, lon), looked up per variable.
+
+        Returns:
+            {"pt_idx": {var: id}, "series": {var: [{"year", "value"}, ...]}}
+        """
+        result = {"pt_idx": {}, "series": {}}
+        for name, (years, matrix) in sorted(self.__series.get(s_agg, {}).items()):
+            geometry = self.get_point_geometry(name, s_agg)
+            if pt_idx is not None:
+                row = int(pt_idx)
+            else:
+                index = self.__series_index.get((s_agg, name))
+                if index is None:
+                    positions = np.asarray(geometry["positions"])
+                    index = self.__series_index[(s_agg, name)] = SphereIndex(positions[:, 1], positions[:, 0])
+                row = index.nearest(lat, lon)
+
+            if not 0 <= row < len(matrix):
+                print(f"Point {row} does not exist in {name}.")
+                continue
+
+            values = np.asarray(matrix[row], dtype=float)
+            result["pt_idx"][name] = int(geometry["ids"][row])
+            result["series"][name] = [
+                {"year": year, "value": None if np.isnan(value) else float(value)}
+                for year, value in zip(years, values)
+            ]
+        return result
+
+    def __resolve(self, key, entry):
+        """
+        Return a loaded layer, loading a lazy entry through the layer cache.
+        """
+        if not callable(entry):
+            return entry
         try:
-            return self.__binary[s_agg][name][year]
+            return self.__layers.get(key, entry)
+        except Exception as e:
+            print(f"Failed to load layer {key}: {e}")
+            return None
+
+    def get_lod_level(self, name, s_agg, zoom):
+        """
+        Pyramid level serving a map zoom, None for the full-resolution layer.
+        """
+        if zoom is None:
+            return None
+        return select_level(list(self.__lod.get(s_agg, {}).get(name, {})), zoom)
+
+    def get_points(self, name, year, s_agg, zoom=None):
+        level = self.get_lod_level(name, s_agg, zoom)
+        try:
+            if level is not None:
+                return self.__resolve((s_agg, name, year, level), self.__lod[s_agg][name][level]["layers"][year])
+            return self.__resolve((s_agg, name, year, None), self.__binary[s_agg][name][year])
         except KeyError:
             print(f"No data found for name: {name} and year: {year}")
             return None
 
+    def get_point_geometry(self, name, s_agg, zoom=None):
+        level = self.get_lod_level(name, s_agg, zoom)
+        try:
+            if level is not None:
+                return self.__lod[s_agg][name][level]["geometry"]
+            return self.__geometry[s_agg][name]
+        except KeyError:
+            print(f"No geometry found for name: {name}")
+            return None
+
+    def get_points_in_bbox(self, name, year, s_agg, bbox, zoom=None):
+        """
+        Return the part of a point layer inside bbox (min_lon, min_lat, max_lon, max_lat).
+        With year=None only the geometry is returned.
+        """
+        if year is None:
+            layer = self.get_point_geometry(name, s_agg, zoom)
+        else:
+            layer = self.get_points(name, year, s_agg, zoom)
+        if layer is None:
+            return None
+
+        # Pyramid levels are small, a plain mask is enough
+        if self.get_lod_level(name, s_agg, zoom) is not None:
+            min_lon, min_lat, max_lon, max_lat = bbox
+            positions = np.asarray(layer["positions"])
+            inside = (positions[:, 0] >= min_lon) & (positions[:, 0] <= max_lon) & (positions[:, 1] >= min_lat) & (positions[:, 1] <= max_lat)
+            return subset_layer(layer, np.nonzero(inside)[0])
+
+        try:
+            grid = self.__grid[s_agg][name]
+        except KeyError:
+            print(f"No grid index found for name: {name}")
+            return None
+        return subset_layer(layer, grid.query(*bbox))
+
+    def get_simplify_tolerance(self, name, s_agg, zoom=None, tolerance=None):
+        """
+        Simplified tract geometry serving a map zoom or tolerance, None for full resolution.
+        """
+        return select_tolerance(list(self.__simplified.get(s_agg, {}).get(name, {})), zoom, tolerance)
+
+    def get_polygons(self, name, year, s_agg, zoom=None, tolerance=None):
+        """
+        Tract layer with the simplified geometry picked for zoom or tolerance.
+        """
+        layer = self.get_points(name, year, s_agg)
+        tolerance = self.get_simplify_tolerance(name, s_agg, zoom, tolerance)
+        if layer is None or tolerance is None:
+            return layer
+        return dict(layer, **self.__simplified[s_agg][name][tolerance])
+
     def get_polygon_layer(self, name, year):
         try:
             return self.__binary[name][year]
@@ -115,32 +333,52 @@ class Structure(object):
             print(f"No data found for name: {name} and year: {year}")
             return None
     
-    @staticmethod
-    def haversine_distance(lat1, lon1, lat2, lon2):
+    haversine_distance = staticmethod(haversine_distance)
+
+    def get_risk_batch(self, pt_idx=None, lats=None, lons=None):
         """
-        Calculate the great-circle distance between two points on the Earth surface.
-        
+        Retrieve risk data for many sites in one vectorized pass.
+
         Parameters:
-            lat1, lon1: Latitude and Longitude of point 1 in decimal degrees
-            lat2, lon2: Latitude and Longitude of point 2 in decimal degrees
-            
+            pt_idx: list of point indices
+            lats, lons: lists of latitudes and longitudes resolved to their nearest point
+
         Returns:
-            Distance in meters
+            Dictionary with the return periods, the resolved index of every site
+            (None when it does not exist) and a (return_period x site) value table.
         """
-        # Earth radius in meters
-        R = 6371000  
-        
-        # Convert decimal degrees to radians
-        lat1_rad, lon1_rad = np.radians(lat1), np.radians(lon1)
-        lat2_rad, lon2_rad = np.radians(lat2), np.radians(lon2)
-        
-        # Haversine formula
-        dlat = lat2_rad - lat1_rad
-        dlon = lon2_rad - lon1_rad
-        a = np.sin(dlat / 2.0)**2 + np.cos(lat1_rad) * np.cos(lat2_rad) * np.sin(dlon / 2.0)**2
-        c = 2 * np.arcsin(np.sqrt(a))
-        distance = R * c
-        return distance
+        if pt_idx is not None:
+            rows = self.__risk.rows(pt_idx)
+        elif self.__risk.has_index:
+            rows = self.__risk.nearest_many(lats, lons)
+        else:
+            print("Latitude and longitude columns are not available in the DataFrame.")
+            rows = np.full(len(lats), -1)
+
+        return {
+            "return_periods": self.__risk.periods,
+            "sites": self.__risk.sites(rows).tolist(),
+            "values": self.__risk.values(rows),
+        }
+
+    def __risk_row(self, identifier):
+        """
+        Row of the risk store for an index or the nearest point to a (lat, lon), None if there is none.
+        """
+        if isinstance(identifier, int):  # If identifier is an index
+            row = self.__risk.row(identifier)
+            if row is None:
+                print(f"Index {identifier} does not exist in the DataFrame.")
+            return row
+
+        if isinstance(identifier, tuple) and len(identifier) == 2:  # If identifier is a lat/lon pair
+            if self.__risk.has_index:
+                return self.__risk.nearest(*identifier)
+            print("Latitude and longitude columns are not available in the DataFrame.")
+            return None
+
+        print("Invalid identifier. Must be an integer index or a tuple (lat, lon).")
+        return None
 
     def get_risk_data(self, identifier):
         """
@@ -152,50 +390,15 @@ class Structure(object):
         Returns:
             List of risk data dictionaries.
         """
-        formatted_data = []
-        properties_of_interest = [
-            'risk_2yr (', 'risk_5yr (', 'risk_10yr',
-            'risk_25yr', 'risk_50yr', 'risk_100yr',
-            'risk_200yr', 'risk_500yr'
-        ]
-        digit_pattern = re.compile(r'\d+')  # Compile the regex once
-        
-        if isinstance(identifier, int):  # If identifier is an index
-            if identifier in self.__risk_df.index:
-                extracted_row = self.__risk_df.loc[identifier, properties_of_interest]
-                formatted_data = [
-                    {"year": digit_pattern.search(column).group(), "value": value}
-                    for column, value in extracted_row.items()
-                ]
-            else:
-                print(f"Index {identifier} does not exist in the DataFrame.")
-        
-        elif isinstance(identifier, tuple) and len(identifier) == 2:  # If identifier is a lat/lon pair
-            lat, lon = identifier
-            
-            if 'latitude' in self.__risk_df.columns and 'longitude' in self.__risk_df.columns:
-                # Extract all latitudes and longitudes
-                latitudes = self.__risk_df['latitude'].values
-                longitudes = self.__risk_df['longitude'].values
-                
-                # Calculate distances using the Haversine formula
-                distances = self.haversine_distance(lat, lon, latitudes, longitudes)
-                
-                # Find the index of the nearest point
-                nearest_index = self.__risk_df.index[np.argmin(distances)]
-                
-                extracted_row = self.__risk_df.loc[nearest_index, properties_of_interest]
-                formatted_data = [
-                    {"year": digit_pattern.search(column).group(), "value": value}
-                    for column, value in extracted_row.items()
-                ]
-            else:
-                print("Latitude and longitude columns are not available in the DataFrame.")
-        
-        else:
-            print("Invalid identifier. Must be an integer index or a tuple (lat, lon).")
-        
-        return formatted_data
+        row = self.__risk_row(identifier)
+        return [] if row is None else self.__risk.records(row)
+
+    def get_risk_json(self, identifier):
+        """
+        get_risk_data already serialized to JSON, rendered straight from the float32 row.
+        """
+        row = self.__risk_row(identifier)
+        return "[]" if row is None else self.__risk.render(row)
 
   
 if __name__ == "__main__":
@@ -0,0 +1,93 @@
+"""
+Point-to-tract membership, computed once per (point set, tract set) pair.
+
+The point geometry of a variable file never changes between years, so the
+spatial join is run once and its (point row, tract row) pairs are cached in
+membership_data_dir under a hash of both geometries. Per-year tract means
+are then one bincount over the whole (points x years) value matrix.
+"""
+
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+from consts import membership_data_dir
+
+
+def geometry_key(points_gdf, tracts_gdf):
+    """
+    Hash of the point coordinates and tract geometries, names the cache file.
+    """
+    digest = hashlib.sha1()
+    digest.update(np.ascontiguousarray(shapely.get_coordinates(points_gdf.geometry.values)).tobytes())
+    for wkb in shapely.to_wkb(tracts_gdf.geometry.values):
+        digest.update(wkb)
+    return digest.hexdigest()
+
+
+def load_membership(points_gdf, tracts_gdf):
+    """
+    Return (point_rows, tract_rows), the pairs of positional rows of
+    gpd.sjoin(points_gdf, tracts_gdf, predicate='within'). A point inside
+    several tracts appears once per tract, as in the join.
+    """
+    path = os.path.join(membership_data_dir, f"{geometry_key(points_gdf, tracts_gdf)}.npz")
+    if os.path.isfile(path):
+        with np.load(path) as cached:
+            return cached["point_rows"], cached["tract_rows"]
+
+    points = gpd.GeoDataFrame(geometry=points_gdf.geometry.values, crs=points_gdf.crs)
+    tracts = gpd.GeoDataFrame(geometry=tracts_gdf.geometry.values, crs=tracts_gdf.crs)
+    joined = gpd.sjoin(points, tracts, how='inner', predicate='within')
+
+    point_rows = joined.index.to_numpy(dtype=np.int64)
+    tract_rows = joined['index_right'].to_numpy(dtype=np.int64)
+    order = np.lexsort((tract_rows, point_rows))
+    point_rows, tract_rows = point_rows[order], tract_rows[order]
+
+    try:
+        os.makedirs(membership_data_dir, exist_ok=True)
+        np.savez(path, point_rows=point_rows, tract_rows=tract_rows)
+    except IOError as e:
+        print(f"Failed to cache tract membership to {path}: {e}")
+    return point_rows, tract_rows
+
+
+def year_matrix(points_gdf, years):
+    """
+    (n_points, n_years) float matrix of the year columns, NaN for missing values.
+    """
+    return points_gdf[years].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float64)
+
+
+def tract_means(point_rows, tract_rows, n_tracts, values):
+    """
+    Mean of the non-missing member values of every tract, for every year at once.
+
+    Parameters:
+        point_rows, tract_rows: membership pairs from load_membership
+        n_tracts: number of tracts
+        values: float (n_points, n_years)
+
+    Returns:
+        float64 (n_tracts, n_years), NaN for tracts without a value that year
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n_years = values.shape[1]
+
+    member_values = values[point_rows]
+    valid = ~np.isnan(member_values)
+
+    # One flat bin per (tract, year)
+    bins = (tract_rows[:, None] * n_years + np.arange(n_years)).ravel()
+    size = n_tracts * n_years
+    sums = np.bincount(bins, weights=np.where(valid, member_values, 0.0).ravel(), minlength=size)
+    counts = np.bincount(bins, weights=valid.ravel(), minlength=size)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.where(counts > 0, sums / counts, np.nan)
+    return means.reshape(n_tracts, n_years)
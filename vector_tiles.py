@@ -0,0 +1,221 @@
+"""
+Mapbox Vector Tiles for census tract layers.
+
+Tract geometries are projected to Web Mercator once per layer and indexed
+with an STRtree. A tile /<z>/<x>/<y> only carries the tracts intersecting it,
+clipped to the tile plus a small buffer and quantized to the tile extent, so
+low zooms send coarse coordinates and high zooms only the tracts in view.
+
+Every feature has the properties GEOID, average_value and color ("#rrggbbaa").
+"""
+
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import shapely
+import mapbox_vector_tile
+from shapely.geometry import shape
+from shapely import GeometryType
+
+MIMETYPE = "application/vnd.mapbox-vector-tile"
+LAYER_NAME = "tracts"
+
+EXTENT = 4096
+BUFFER = 64
+
+# Half the width of the Web Mercator square in meters
+ORIGIN_SHIFT = 20037508.342789244
+
+
+def to_mercator(coordinates):
+    """
+    Project (n, 2) longitude/latitude coordinates to Web Mercator meters.
+    """
+    lon = coordinates[:, 0]
+    lat = np.clip(coordinates[:, 1], -85.05112878, 85.05112878)
+    x = np.radians(lon) * 6378137.0
+    y = np.log(np.tan(np.pi / 4 + np.radians(lat) / 2)) * 6378137.0
+    return np.column_stack((x, y))
+
+
+def tile_bounds(z, x, y):
+    """
+    Web Mercator bounds (min_x, min_y, max_x, max_y) of an XYZ tile.
+    """
+    size = 2 * ORIGIN_SHIFT / 2 ** z
+    min_x = -ORIGIN_SHIFT + x * size
+    max_y = ORIGIN_SHIFT - y * size
+    return (min_x, max_y - size, min_x + size, max_y)
+
+
+def tile_range(bounds, z):
+    """
+    Inclusive x and y ranges of the tiles covering Web Mercator bounds at zoom z.
+    """
+    size = 2 * ORIGIN_SHIFT / 2 ** z
+    n = 2 ** z
+    min_x, min_y, max_x, max_y = bounds
+    x0 = int(np.clip(np.floor((min_x + ORIGIN_SHIFT) / size), 0, n - 1))
+    x1 = int(np.clip(np.floor((max_x + ORIGIN_SHIFT) / size), 0, n - 1))
+    y0 = int(np.clip(np.floor((ORIGIN_SHIFT - max_y) / size), 0, n - 1))
+    y1 = int(np.clip(np.floor((ORIGIN_SHIFT - min_y) / size), 0, n - 1))
+    return range(x0, x1 + 1), range(y0, y1 + 1)
+
+
+def hex_color(color):
+    return "#" + "".join(f"{int(c):02x}" for c in color)
+
+
+def layer_tracts(layer):
+    """
+    Shapely geometries, GEOIDs, values and colors of a ct_ layer, either
+    array-backed (see layer_store) or a {"tracts": [...]} pickle.
+    """
+    if "tracts" in layer:
+        tracts = layer["tracts"]
+        geometries = np.array([shape(t["geometry"]) for t in tracts], dtype=object)
+        values = [np.nan if t["average_value"] is None else t["average_value"] for t in tracts]
+        return geometries, [t["GEOID"] for t in tracts], values, [t["color"] for t in tracts]
+
+    offsets = (np.asarray(layer["rings"]), np.asarray(layer["polygons"]), np.asarray(layer["parts"]))
+    geometries = shapely.from_ragged_array(GeometryType.MULTIPOLYGON, np.asarray(layer["vertices"], dtype=float), offsets)
+    return geometries, layer["geoids"], layer["values"], layer["colors"]
+
+
+class TractTiles(object):
+    """
+    Vector tile cutter over the tracts of one ct_ layer.
+    """
+
+    def __init__(self, layer) -> None:
+        geometries, geoids, values, colors = layer_tracts(layer)
+        self.__geometries = shapely.transform(geometries, to_mercator)
+        self.__tree = shapely.STRtree(self.__geometries)
+
+        self.__properties = []
+        for geoid, value, color in zip(geoids, values, colors):
+            self.__properties.append({
+                "GEOID": str(geoid),
+                "average_value": None if np.isnan(value) else float(value),
+                "color": hex_color(color),
+            })
+
+    @property
+    def bounds(self):
+        return tuple(shapely.total_bounds(self.__geometries))
+
+    def encode(self, z, x, y):
+        """
+        Encode tile (z, x, y) as MVT bytes, None when no tract intersects it.
+        """
+        bounds = tile_bounds(z, x, y)
+        pad = (bounds[2] - bounds[0]) * BUFFER / EXTENT
+        clip_box = (bounds[0] - pad, bounds[1] - pad, bounds[2] + pad, bounds[3] + pad)
+
+        rows = self.__tree.query(shapely.box(*clip_box), predicate="intersects")
+        if len(rows) == 0:
+            return None
+
+        # Drop the vertices closer together than one tile unit before clipping
+        tolerance = (bounds[2] - bounds[0]) / EXTENT
+        clipped = shapely.clip_by_rect(shapely.simplify(self.__geometries[np.sort(rows)], tolerance), *clip_box)
+
+        features = []
+        for row, geometry in zip(np.sort(rows), clipped):
+            if geometry.is_empty:
+                continue
+            properties = {k: v for k, v in self.__properties[row].items() if v is not None}
+            features.append({"geometry": geometry, "properties": properties})
+        if not features:
+            return None
+
+        return mapbox_vector_tile.encode(
+            [{"name": LAYER_NAME, "features": features}],
+            default_options={"quantize_bounds": bounds, "extents": EXTENT},
+        )
+
+
+class TileSourceCache(object):
+    """
+    Small LRU of TractTiles, projecting and indexing a layer is the expensive part.
+    Safe to share between threads, concurrent misses on one key build it once.
+    """
+
+    def __init__(self, max_entries) -> None:
+        self.__entries = OrderedDict()
+        self.__max_entries = max_entries
+        self.__lock = threading.Lock()
+        self.__loading = {}
+
+    def __lookup(self, key):
+        with self.__lock:
+            tiles = self.__entries.get(key)
+            if tiles is not None:
+                self.__entries.move_to_end(key)
+            return tiles
+
+    def get(self, key, load_layer):
+        tiles = self.__lookup(key)
+        if tiles is not None:
+            return tiles
+
+        with self.__lock:
+            key_lock = self.__loading.setdefault(key, threading.Lock())
+
+        # Other layers stay served while this one is built
+        with key_lock:
+            tiles = self.__lookup(key)
+            if tiles is None:
+                layer = load_layer()
+                if layer is not None:
+                    tiles = TractTiles(layer)
+                    with self.__lock:
+                        self.__entries[key] = tiles
+                        while len(self.__entries) > self.__max_entries:
+                            self.__entries.popitem(last=False)
+
+        with self.__lock:
+            self.__loading.pop(key, None)
+        return tiles
+
+
+def layer_tiles_dir(tiles_dir, s_agg, name, year):
+    return os.path.join(tiles_dir, s_agg, name, str(year))
+
+
+def tile_path(tiles_dir, s_agg, name, year, z, x, y):
+    return os.path.join(layer_tiles_dir(tiles_dir, s_agg, name, year), str(z), str(x), f"{y}.mvt")
+
+
+def clear_tiles(tiles_dir, s_agg, name, year):
+    """
+    Remove the pre-seeded tiles of a layer, they are served before any tile
+    cut from the layer itself and must not outlive it.
+    """
+    shutil.rmtree(layer_tiles_dir(tiles_dir, s_agg, name, year), ignore_errors=True)
+
+
+def seed_tiles(layer, tiles_dir, s_agg, name, year, zoom_levels):
+    """
+    Pre-render every non-empty tile of a layer at the given zoom levels to
+    tiles_dir/<s_agg>/<name>/<year>/<z>/<x>/<y>.mvt. Returns the number of tiles written.
+    """
+    tiles = TractTiles(layer)
+    n_tiles = 0
+    for z in zoom_levels:
+        xs, ys = tile_range(tiles.bounds, z)
+        for x in xs:
+            for y in ys:
+                body = tiles.encode(z, x, y)
+                if body is None:
+                    continue
+
+                path = tile_path(tiles_dir, s_agg, name, year, z, x, y)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'wb') as f:
+                    f.write(body)
+                n_tiles += 1
+    return n_tiles
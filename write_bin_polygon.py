@@ -1,56 +1,129 @@
 import numpy as np
 import json
+import argparse
 import geopandas as gpd
-from shapely.geometry import mapping
-from consts import files_path, binary_data_dir
-import pickle
+import shapely
+import hashlib
+from consts import files_path, binary_data_dir, tiles_data_dir, tile_seed_zoom_levels, polygon_simplify_tolerances, quantize_max_error
+from colormap import build_threshold_rgba, colors_for_values
+from pipeline import run_jobs, get_shared, add_workers_argument, report_quantization
+from vector_tiles import seed_tiles, clear_tiles
+from layer_store import write_polygon_geometry, write_tract_reference, write_polygon_attributes, write_polygon_shapes, write_quantized_values, layer_dir, dataset_dir, tract_set_dir
+from build_manifest import BuildManifest, file_hash, value_hash, code_version
+from tract_membership import load_membership, year_matrix, tract_means
 import os
 from collections import defaultdict
 
-def build_threshold_rgba(a, C):
-    # Bins normalized between 0 and 1
-    norm = [(float(i) - min(a)) / (max(a) - min(a)) for i in a]
-
-    # Generate the desired output format
-    output = []
-
-    for value, color in zip(a, C):
-        rgba_color = (int(color[0]), int(color[1]), int(color[2]), 255)
-        output.append({"value": value, "color": rgba_color})
-
-    return output
-
-def get_color_for_value(var_threshold, value):
+def flatten_tracts(geometries):
     """
-    Given a value and a list of thresholds, return the corresponding color.
-    If the value is non-numeric, return a fully transparent color.
-    If the value is below the first threshold, return the first color.
-    If the value is above the last threshold, return the last color.
+    Flatten tract polygons into (vertices, ring starts, polygon starts, part starts).
     """
-    if not isinstance(value, (int, float)) or value == 0:
-        # Fully transparent
-        return (0, 0, 0, 0)
+    geometry_type, vertices, offsets = shapely.to_ragged_array(np.asarray(geometries))
+    if geometry_type == shapely.GeometryType.POLYGON:
+        # Only single polygons, one polygon per tract
+        offsets = offsets + (np.arange(len(offsets[1])),)
+    return (vertices,) + tuple(offsets)
 
-    for threshold in var_threshold:
-        if value <= threshold["value"]:
-            return threshold["color"]
-    # If value exceeds all var_threshold, return the last color
-    return var_threshold[-1]["color"]
-
-def process_files(files, tracts_gdf):
+def simplify_tracts(geometries, tolerances):
+    """
+    Flattened coverage simplifications of the tract polygons, {tolerance: arrays}.
+    Shared edges are simplified once, so neighbouring tracts stay gap-free.
+    """
+    variants = {}
+    for tolerance in tolerances:
+        simplified = shapely.coverage_simplify(np.asarray(geometries), tolerance)
+        variants[tolerance] = flatten_tracts(simplified)
+        print(f"Simplified tracts at {tolerance}: {len(variants[tolerance][0])} vertices")
+    return variants
+
+def process_year(job):
+    """
+    Average one (var_name, year) work unit by census tract and save the per-tract values and colors.
+    """
+    var_name, year = job
+    source = get_shared("points")[var_name]
+
+    # Tract means of every year were computed at once, in the order of the
+    # shared tract table. Tracts without any point stay NaN and transparent.
+    average_value = source["means"][:, source["years"].index(year)]
+
+    # Assign colors based on average values
+    colors = colors_for_values(source["threshold"], average_value)
+
+    filepath = layer_dir(var_name, year, "ct")
+    try:
+        # Tiles seeded from the previous version of the layer would be served over the new one
+        clear_tiles(tiles_data_dir, "ct", var_name, year)
+        write_polygon_attributes(average_value, colors, var_name, year, "ct")
+        quant = write_quantized_values(average_value, filepath, quantize_max_error)
+        print(f"Saved binary data for {var_name} {year} to {filepath}")
+    except IOError as e:
+        print(f"Failed to save binary data to {filepath}: {e}")
+        return None
+
+    if get_shared("seed_tiles"):
+        layer = dict(get_shared("geometry"), values=average_value, colors=colors)
+        n_tiles = seed_tiles(layer, tiles_data_dir, "ct", var_name, year, tile_seed_zoom_levels)
+        print(f"Seeded {n_tiles} vector tiles for {var_name} {year}")
+    return quant
+
+def process_files(files, tracts_gdf, workers=1, seed=False, force=False):
     """
     Process each variable file to compute average values by census tract and include geometries.
+    With seed=True the vector tiles of every layer are pre-rendered as well.
+    Outputs whose points file, tracts, threshold, settings and code are
+    unchanged since the last run are kept, unless force is set.
     """
 
     # Directory to save processed pickle files
     os.makedirs(binary_data_dir, exist_ok=True)  # Create the directory if it doesn't exist
 
+    # Flatten the tract polygons once, every variable and year shares them
+    vertices, rings, polygons, parts = flatten_tracts(tracts_gdf.geometry)
+    tracts_written = False
+    geometry = {
+        "length": len(tracts_gdf), "vertices": vertices, "rings": rings, "polygons": polygons,
+        "parts": parts, "geoids": tracts_gdf['GEOID'].astype(str).to_numpy(),
+    }
+
+    jobs = []
+    shared = {"points": {}, "geometry": geometry, "seed_tiles": seed}
+    manifest = BuildManifest()
+    code = code_version("write_bin_polygon", "colormap", "layer_store", "tract_membership", "vector_tiles", "binary_format")
+    tracts_hash = value_hash([
+        hashlib.sha1(b"".join(shapely.to_wkb(np.asarray(tracts_gdf.geometry)))).hexdigest(),
+        geometry["geoids"].tolist(),
+    ])
+    fingerprints = {}
+
     for file in files:
         var_name = file["var_name"]
         file_path = file["path"]
 
         print(f"Processing variable: {var_name}")
 
+        # Everything the outputs of this file are built from
+        try:
+            fingerprint = {
+                "input": file_hash(file_path),
+                "tracts": tracts_hash,
+                "threshold": value_hash(file["threshold"]),
+                "settings": value_hash([polygon_simplify_tolerances, seed and tile_seed_zoom_levels, quantize_max_error]),
+                "code": code,
+            }
+        except FileNotFoundError:
+            print(f"File not found: {file_path}. Skipping {var_name}.")
+            continue
+
+        # Nothing to do when the dataset and every year it had are fresh
+        key = f"write_bin_polygon/{var_name}"
+        entry = manifest.entry(key)
+        if not force and manifest.is_fresh(key, fingerprint, dataset_dir(var_name, "ct")) and os.path.isdir(tract_set_dir(tracts_hash)) and all(
+            manifest.is_fresh(f"{key}/{year}", fingerprint, layer_dir(var_name, year, "ct")) for year in entry["years"]
+        ):
+            print(f"{var_name} is up to date. Skipping {var_name}.")
+            continue
+
         # Open and load the GeoJSON file using geopandas
         try:
             points_gdf = gpd.read_file(file_path)
@@ -81,52 +154,41 @@ def process_files(files, tracts_gdf):
 
         print(f"Processing variable '{var_name}' for years: {', '.join(years)}")
 
-        for year in years:
-            # Select the value column for the current year
-            if year not in points_gdf.columns:
-                print(f"Year '{year}' not found in {file_path}. Skipping year.")
-                continue
-
-            # Create a GeoDataFrame with only necessary columns
-            df_year = points_gdf[['geometry', year]].copy()
-            df_year = df_year.dropna(subset=[year])
-
-            # Spatial join with tracts to assign each point to a tract
-            try:
-                joined = gpd.sjoin(df_year, tracts_gdf, how='inner', predicate='within')
-            except Exception as e:
-                print(f"Error during spatial join for {var_name} {year}: {e}")
-                continue
-
-            # Group by tract and compute average
-            grouped = joined.groupby('GEOID')[year].mean().reset_index()
-            grouped.rename(columns={year: 'average_value'}, inplace=True)
+        # Assign points to tracts once, then average every year in one pass
+        try:
+            point_rows, tract_rows = load_membership(points_gdf, tracts_gdf)
+        except Exception as e:
+            print(f"Error during spatial join for {var_name}: {e}. Skipping {var_name}.")
+            continue
+        means = tract_means(point_rows, tract_rows, len(tracts_gdf), year_matrix(points_gdf, years))
 
-            # Assign colors based on average values
-            grouped['color'] = grouped['average_value'].apply(lambda x: get_color_for_value(file["threshold"], x))
+        # The polygons and their simplified variants are written once per tract set,
+        # the datasets of every variable reference them by the tract set hash
+        if not tracts_written:
+            write_polygon_geometry(vertices, rings, polygons, parts, geometry["geoids"], tracts_hash)
+            for tolerance, shapes in simplify_tracts(tracts_gdf.geometry, polygon_simplify_tolerances).items():
+                write_polygon_shapes(*shapes, tracts_hash, tolerance)
+            tracts_written = True
+        write_tract_reference(tracts_hash, var_name, "ct")
+        manifest.record(key, fingerprint, years=years)
+        fingerprints[var_name] = fingerprint
 
-            # Merge with tracts_gdf to get geometries
-            grouped = grouped.merge(tracts_gdf[['GEOID', 'geometry']], on='GEOID', how='left')
+        # Only the years built from another fingerprint, or missing, are rebuilt
+        stale_years = [year for year in years if force or not manifest.is_fresh(f"{key}/{year}", fingerprint, layer_dir(var_name, year, "ct"))]
+        print(f"Rebuilding {len(stale_years)} of {len(years)} years of {var_name}")
 
-            # Convert geometries to GeoJSON-like dicts
-            grouped['geometry'] = grouped['geometry'].apply(lambda geom: mapping(geom))
+        shared["points"][var_name] = {"means": means, "years": years, "path": file_path, "threshold": file["threshold"]}
+        jobs.extend((var_name, year) for year in stale_years)
 
-            # Prepare the binary data
-            binary_data = {
-                "tracts": grouped[['GEOID', 'average_value', 'color', 'geometry']].to_dict(orient='records')
-            }
+    # Fan the (var_name, year) work units out, tract means and geometry are shared read-only
+    results = run_jobs(process_year, jobs, shared, workers)
 
-            # Define the filename
-            filename = f"ct_{var_name}_{year}.pickle"
-            filepath = os.path.join(binary_data_dir, filename)
+    for (var_name, year), quant in zip(jobs, results):
+        if quant is not None:
+            manifest.record(f"write_bin_polygon/{var_name}/{year}", fingerprints[var_name])
+    manifest.save()
 
-            # Save the binary data using pickle
-            try:
-                with open(filepath, 'wb') as pf:
-                    pickle.dump(binary_data, pf)
-                print(f"Saved binary data for {var_name} {year} to {filepath}")
-            except IOError as e:
-                print(f"Failed to save binary data to {filepath}: {e}")
+    report_quantization(jobs, results)
 
 # Define thresholds and colors as in your original code
 start, end, n = -50, 50, 38
@@ -205,22 +267,30 @@ geojson_files = [
     {"var_name": "prcp", "path": f"{files_path}/Illinois_prcp_risks_round.json", "threshold": prcp_threshold},
 ]
 
-# Load Census Tracts GeoJSON
-tracts_geojson_path = f"{files_path}/tl_2023_17_tract.json"  # Update the path accordingly
-try:
-    tracts_gdf = gpd.read_file(tracts_geojson_path)
-except FileNotFoundError:
-    print(f"Census tract file not found: {tracts_geojson_path}. Exiting.")
-    exit(1)
-except Exception as e:
-    print(f"Error loading census tracts GeoJSON: {e}. Exiting.")
-    exit(1)
-
-# Ensure there is a unique identifier for each tract
-# Replace 'GEOID' with the actual property name in your GeoJSON
-if 'GEOID' not in tracts_gdf.columns:
-    print("Error: 'GEOID' field not found in census tracts GeoJSON. Please update the code with the correct field name.")
-    exit(1)
-
-# Process the files
-process_files(geojson_files, tracts_gdf)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Write the census tract layers.')
+    add_workers_argument(parser)
+    parser.add_argument('--seed-tiles', action='store_true',
+                        help='Also pre-render the vector tiles of every layer.')
+    parser.add_argument('-f', '--force', action='store_true', help='Rebuild every output, ignoring the build manifest.')
+    args = parser.parse_args()
+
+    # Load Census Tracts GeoJSON
+    tracts_geojson_path = f"{files_path}/tl_2023_17_tract.json"  # Update the path accordingly
+    try:
+        tracts_gdf = gpd.read_file(tracts_geojson_path)
+    except FileNotFoundError:
+        print(f"Census tract file not found: {tracts_geojson_path}. Exiting.")
+        exit(1)
+    except Exception as e:
+        print(f"Error loading census tracts GeoJSON: {e}. Exiting.")
+        exit(1)
+
+    # Ensure there is a unique identifier for each tract
+    # Replace 'GEOID' with the actual property name in your GeoJSON
+    if 'GEOID' not in tracts_gdf.columns:
+        print("Error: 'GEOID' field not found in census tracts GeoJSON. Please update the code with the correct field name.")
+        exit(1)
+
+    # Process the files
+    process_files(geojson_files, tracts_gdf, args.workers, args.seed_tiles, args.force)
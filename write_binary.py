@@ -1,6 +1,13 @@
 import numpy as np
 import json
-from consts import files_path, binary_data_dir
+import argparse
+from consts import files_path, binary_data_dir, lod_zoom_levels, lod_cell_pixels, quantize_max_error
+from layer_store import write_point_geometry, write_point_bins, write_point_series, write_quantized_values, dataset_dir, layer_dir
+from build_manifest import BuildManifest, file_hash, value_hash, code_version
+from point_source import read_point_features
+from lod import write_pyramid_geometry, write_pyramid_year
+from colormap import build_threshold_rgba, bins_for_values, build_palette, palette_bounds
+from pipeline import run_jobs, get_shared, add_workers_argument, report_quantization
 import pickle
 import os
 from collections import defaultdict
@@ -20,22 +27,6 @@ def build_threshold_hex(a, C):
 
     print(output)
 
-def build_threshold_rgba(a, C):   
-
-    # Bins normalized between 0 and 1
-    norm = [(float(i) - min(a)) / (max(a) - min(a)) for i in a]
-
-    # Generate the desired output format
-    output = []
-    
-    for value, color in zip(a, C):
-        # Create RGBA string
-        # rgba_color = f"rgba({int(color[0] * 255)}, {int(color[1] * 255)}, {int(color[2] * 255)}, 1)"
-        rgba_color = (int(color[0]), int(color[1]), int(color[2]), 255)
-        output.append({"value": value, "color": rgba_color})
-    
-    return output
-
 def hex_to_rgba(hex_color, alpha=255):
     """
     Convert a hexadecimal color string to an RGBA tuple.
@@ -49,32 +40,71 @@ def hex_to_rgba(hex_color, alpha=255):
     
     return (r, g, b, alpha)
 
-def get_color_for_value(var_threshold, value):
+def process_year(job):
     """
-    Given a value and a list of thresholds, return the corresponding color.
-    If the value is non-numeric, return a fully transparent color.
-    If the value is below the first threshold, return the first color.
-    If the value is above the last threshold, return the last color.
+    Build and save the values and palette indices of one (var_name, year) work unit.
+    """
+    var_name, year = job
+    source = get_shared(var_name)
+
+    # Every year is a column of the value matrix built in a single pass over the features
+    values = source["values"][:, source["years"].index(year)]
+
+    # Palette index of the whole year in one vectorized call
+    bins = bins_for_values(source["threshold"], values)
+
+    # Save the per-year values and palette indices as memory-mappable columns
+    try:
+        filepath = write_point_bins(values, bins, var_name, year)
+        quant = write_quantized_values(values, filepath, quantize_max_error)
+        write_pyramid_year(source["levels"], values, source["threshold"], var_name, year)
+        print(f"Saved binary data for {var_name} {year} to {filepath}")
+        return quant
+    except IOError as e:
+        print(f"Failed to save binary data for {var_name} {year}: {e}")
+        return None
+
+def process_files(files, workers=1, force=False):
+    """
+    Write the point layers of every file. Outputs whose input file, threshold,
+    pyramid and quantization settings and code are unchanged since the last run are kept,
+    unless force is set.
     """
-    if not isinstance(value, (int, float)) or value == 0:
-        # Fully transparent
-        return (0, 0, 0, 0)
-    
-    for threshold in var_threshold:
-        if value <= threshold["value"]:
-            return threshold["color"]
-    # If value exceeds all var_threshold, return the last color
-    return var_threshold[-1]["color"]
 
-def process_files(files):
-    
     # Directory to save processed pickle files
     os.makedirs(binary_data_dir, exist_ok=True)  # Create the directory if it doesn't exist
 
+    jobs = []
+    shared = {}
+    manifest = BuildManifest()
+    code = code_version("write_binary", "colormap", "layer_store", "lod", "point_source", "binary_format")
+    fingerprints = {}
+
     for file in files:
         var_name = file["var_name"]
         file_path = file["path"]
 
+        # Everything the outputs of this file are built from
+        try:
+            fingerprint = {
+                "input": file_hash(file_path),
+                "threshold": value_hash(file["threshold"]),
+                "settings": value_hash([lod_zoom_levels, lod_cell_pixels, quantize_max_error]),
+                "code": code,
+            }
+        except FileNotFoundError:
+            print(f"File not found: {file_path}. Skipping {var_name}.")
+            continue
+
+        # Nothing to do when the dataset and every year it had are fresh
+        key = f"write_binary/{var_name}"
+        entry = manifest.entry(key)
+        if not force and manifest.is_fresh(key, fingerprint, dataset_dir(var_name)) and all(
+            manifest.is_fresh(f"{key}/{year}", fingerprint, layer_dir(var_name, year)) for year in entry["years"]
+        ):
+            print(f"{var_name} is up to date. Skipping {var_name}.")
+            continue
+
         # Open and load the GeoJSON file
         try:
             with open(file_path, 'r', encoding='utf-8') as f:
@@ -104,70 +134,37 @@ def process_files(files):
 
         print(f"Processing variable '{var_name}' for years: {', '.join(years)}")
 
-        for year in years:
-            positions = []
-            colors = []
-            values = []  # New list to store values
-            ids = []  # List to store IDs
-            processed_features = 0
-            point_id = 0  # Initialize ID counter
-
-            for feature in features:
-                coord = feature.get("geometry", {}).get("coordinates", [])
-                if not coord or len(coord) < 2:
-                    print(f"Invalid coordinates in feature: {feature}. Skipping feature.")
-                    continue
-
-                properties = feature.get("properties", {})
-
-                # Retrieve the value for the current year
-                raw_value = properties.get(year)
-
-                # Convert raw_value to float, handle errors
-                if raw_value is None:
-                    value = None  # Will be handled as transparent
-                else:
-                    try:
-                        value = float(raw_value)
-                    except (ValueError, TypeError):
-                        print(f"Warning: Unable to convert value '{raw_value}' to float for feature with properties {properties}")
-                        value = None  # Will be handled as transparent
-
-                # Get the color based on the value and thresholds
-                try:
-                    r, g, b, a = get_color_for_value(file["threshold"], value)
-                except ValueError as e:
-                    print(f"Error converting color for value {value}: {e}")
-                    r, g, b, a = (0, 0, 0, 0)  # Fully transparent as fallback
-
-                # Append data
-                positions.extend([coord[0], coord[1]])
-                colors.extend([r, g, b, a])
-                values.append(value)  # Store the value
-                ids.append(point_id)  # Add the current point ID
-                point_id += 1  # Increment ID counter
-                processed_features += 1
-
-            # Prepare the binary data
-            binary_data = {
-                "length": processed_features,
-                "positions": positions,
-                "colors": colors,
-                "values": values,
-                "ids": ids
-            }
+        # Walk the features once, positions and ids are the same for every year
+        positions, values = read_point_features(features, years)
+        ids = np.arange(len(positions), dtype=np.uint32)  # Sequential point IDs
 
-            # Define the filename
-            filename = f"{var_name}_{year}.pickle"
-            filepath = os.path.join(binary_data_dir, filename)
+        try:
+            filepath = write_point_geometry(positions, ids, var_name, palette=build_palette(file["threshold"]), bounds=palette_bounds(file["threshold"]))
+            levels = write_pyramid_geometry(positions, ids, var_name, palette=build_palette(file["threshold"]))
+            write_point_series(values, years, var_name)
+            print(f"Saved geometry and {len(levels)} pyramid levels for {var_name} to {filepath}")
+        except IOError as e:
+            print(f"Failed to save geometry for {var_name}: {e}")
+            continue
+        manifest.record(key, fingerprint, years=years)
+        fingerprints[var_name] = fingerprint
+
+        # Only the years built from another fingerprint, or missing, are rebuilt
+        stale_years = [year for year in years if force or not manifest.is_fresh(f"{key}/{year}", fingerprint, layer_dir(var_name, year))]
+        print(f"Rebuilding {len(stale_years)} of {len(years)} years of {var_name}")
+
+        shared[var_name] = {"values": values, "years": years, "levels": levels, "threshold": file["threshold"]}
+        jobs.extend((var_name, year) for year in stale_years)
 
-            # Save the binary data using pickle
-            try:
-                with open(filepath, 'wb') as pf:
-                    pickle.dump(binary_data, pf)
-                print(f"Saved binary data for {var_name} {year} to {filepath}")
-            except IOError as e:
-                print(f"Failed to save binary data to {filepath}: {e}")
+    # Fan the (var_name, year) work units out, the value matrices are shared read-only
+    results = run_jobs(process_year, jobs, shared, workers)
+
+    for (var_name, year), quant in zip(jobs, results):
+        if quant is not None:
+            manifest.record(f"write_binary/{var_name}/{year}", fingerprints[var_name])
+    manifest.save()
+
+    report_quantization(jobs, results)
 
 start, end, n = -50, 50, 38
 temp_range = [round(start + (end - start) * i / (n - 1), 1) for i in range(n)]
@@ -246,7 +243,10 @@ geojson_files = [
 ]
 
 
-process_files(geojson_files)
-
-
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Write the point layers.')
+    add_workers_argument(parser)
+    parser.add_argument('-f', '--force', action='store_true', help='Rebuild every output, ignoring the build manifest.')
+    args = parser.parse_args()
 
+    process_files(geojson_files, args.workers, args.force)
@@ -1,52 +1,29 @@
 import numpy as np
 import json
-from consts import files_path, binary_data_dir
-import pickle
+from consts import files_path, binary_data_dir, interp_lut_size, quantize_max_error
+from layer_store import write_point_geometry, write_point_attributes, write_point_series, write_quantized_values
+from build_manifest import BuildManifest
+from point_source import read_point_features
+from lod import write_pyramid_geometry, write_pyramid_interp_year
+from colormap import build_threshold_rgba, build_interp_lut, interp_colors_for_values
 import os
-from collections import defaultdict
 
 
-def build_threshold_rgba(a, C):
-    # Normalize thresholds to the range [0, 1]
-    norm = np.array([(float(i) - min(a)) / (max(a) - min(a)) for i in a])
-    return [{"value": n, "color": tuple(color)} for n, color in zip(norm, C)]
-
-
-def interpolate_color(value, var_threshold):
-    """
-    Interpolate color for a given value based on the thresholds.
-    """
-    if not isinstance(value, (int, float)) or np.isnan(value):
-        return (0, 0, 0, 0)  # Fully transparent for invalid values
-
-    # Extract values and colors from the thresholds
-    thresholds = [t["value"] for t in var_threshold]
-    colors = np.array([t["color"] for t in var_threshold])
-
-    # Normalize the value to [0, 1]
-    value_normalized = (value - min(thresholds)) / (max(thresholds) - min(thresholds))
-    value_normalized = np.clip(value_normalized, 0, 1)
-
-    # Interpolate each color channel (RGBA)
-    r = np.interp(value_normalized, thresholds, colors[:, 0])
-    g = np.interp(value_normalized, thresholds, colors[:, 1])
-    b = np.interp(value_normalized, thresholds, colors[:, 2])
-    a = np.interp(value_normalized, thresholds, colors[:, 3]) if colors.shape[1] == 4 else 255
-
-    return int(r), int(g), int(b), int(a)
-
-
-def get_color_for_value(var_threshold, value):
+def process_files(files):
     """
-    Wrapper for interpolate_color.
+    Write the point layers of every file, colored by interpolating between
+    the threshold colors instead of binning. Every variable gets one
+    interp_lut_size lookup table, each year is colored in one vectorized call.
+
+    The same datasets are written by write_binary.py. Every output of a
+    dataset is rewritten here (pyramid levels, quantized values and series
+    included) and its write_binary manifest entries are dropped, so the
+    next write_binary run rebuilds it instead of skipping it.
     """
-    return interpolate_color(value, var_threshold)
 
-
-def process_files(files):
-    
     # Directory to save processed pickle files
     os.makedirs(binary_data_dir, exist_ok=True)  # Create the directory if it doesn't exist
+    manifest = BuildManifest()
 
     for file in files:
         var_name = file["var_name"]
@@ -81,70 +58,37 @@ def process_files(files):
 
         print(f"Processing variable '{var_name}' for years: {', '.join(years)}")
 
-        for year in years:
-            positions = []
-            colors = []
-            values = []  # New list to store values
-            ids = []  # List to store IDs
-            processed_features = 0
-            point_id = 0  # Initialize ID counter
-
-            for feature in features:
-                coord = feature.get("geometry", {}).get("coordinates", [])
-                if not coord or len(coord) < 2:
-                    print(f"Invalid coordinates in feature: {feature}. Skipping feature.")
-                    continue
-
-                properties = feature.get("properties", {})
-
-                # Retrieve the value for the current year
-                raw_value = properties.get(year)
-
-                # Convert raw_value to float, handle errors
-                if raw_value is None:
-                    value = None  # Will be handled as transparent
-                else:
-                    try:
-                        value = float(raw_value)
-                    except (ValueError, TypeError):
-                        print(f"Warning: Unable to convert value '{raw_value}' to float for feature with properties {properties}")
-                        value = None  # Will be handled as transparent
-
-                # Get the color based on the value and thresholds
-                try:
-                    r, g, b, a = get_color_for_value(file["threshold"], value, var_name)
-                except ValueError as e:
-                    print(f"Error converting color for value {value}: {e}")
-                    r, g, b, a = (0, 0, 0, 0)  # Fully transparent as fallback
-
-                # Append data
-                positions.extend([coord[0], coord[1]])
-                colors.extend([r, g, b, a])
-                values.append(value)  # Store the value
-                ids.append(point_id)  # Add the current point ID
-                point_id += 1  # Increment ID counter
-                processed_features += 1
-
-            # Prepare the binary data
-            binary_data = {
-                "length": processed_features,
-                "positions": positions,
-                "colors": colors,
-                "values": values,
-                "ids": ids
-            }
-
-            # Define the filename
-            filename = f"{var_name}_{year}.pickle"
-            filepath = os.path.join(binary_data_dir, filename)
-
-            # Save the binary data using pickle
+        # Walk the features once, positions and ids are the same for every year
+        positions, values = read_point_features(features, years)
+        ids = np.arange(len(positions), dtype=np.uint32)  # Sequential point IDs
+
+        try:
+            filepath = write_point_geometry(positions, ids, var_name)
+            levels = write_pyramid_geometry(positions, ids, var_name)
+            write_point_series(values, years, var_name)
+            print(f"Saved geometry and {len(levels)} pyramid levels for {var_name} to {filepath}")
+        except IOError as e:
+            print(f"Failed to save geometry for {var_name}: {e}")
+            continue
+
+        # The binned outputs of write_binary.py are being replaced
+        manifest.discard(f"write_binary/{var_name}")
+        manifest.save()
+
+        # The colormap is sampled once per variable
+        interp_lut = build_interp_lut(file["threshold"], interp_lut_size)
+
+        for column, year in enumerate(years):
+            colors = interp_colors_for_values(interp_lut, values[:, column])
+
+            # Save the per-year values and colors as memory-mappable columns
             try:
-                with open(filepath, 'wb') as pf:
-                    pickle.dump(binary_data, pf)
+                filepath = write_point_attributes(values[:, column], colors, var_name, year)
+                write_quantized_values(values[:, column], filepath, quantize_max_error)
+                write_pyramid_interp_year(levels, values[:, column], interp_lut, var_name, year)
                 print(f"Saved binary data for {var_name} {year} to {filepath}")
             except IOError as e:
-                print(f"Failed to save binary data to {filepath}: {e}")
+                print(f"Failed to save binary data for {var_name} {year}: {e}")
 
 start, end, n = -50, 50, 38
 temp_range = [round(start + (end - start) * i / (n - 1), 1) for i in range(n)]
@@ -178,4 +122,6 @@ geojson_files = [
     # {"var_name": "prcp", "path": f"{files_path}/Illinois_prcp_risks_round.json", "threshold": prcp_threshold},
 ]
 
-process_files(geojson_files)
+
+if __name__ == "__main__":
+    process_files(geojson_files)
@@ -1,43 +1,55 @@
 import numpy as np
 import json
+import argparse
 import geopandas as gpd
 from shapely.geometry import Point
 from consts import files_path, binary_data_dir
+from colormap import build_threshold_rgba, colors_for_values
+from pipeline import run_jobs, get_shared, add_workers_argument
+from tract_membership import load_membership, year_matrix, tract_means
 import pickle
 import os
 from collections import defaultdict
 
-def build_threshold_rgba(a, C):
-    # Bins normalized between 0 and 1
-    norm = [(float(i) - min(a)) / (max(a) - min(a)) for i in a]
-
-    # Generate the desired output format
-    output = []
-
-    for value, color in zip(a, C):
-        rgba_color = (int(color[0]), int(color[1]), int(color[2]), 255)
-        output.append({"value": value, "color": rgba_color})
-
-    return output
-
-def get_color_for_value(var_threshold, value):
+def process_year_geojson(job):
     """
-    Given a value and a list of thresholds, return the corresponding color.
-    If the value is non-numeric, return a fully transparent color.
-    If the value is below the first threshold, return the first color.
-    If the value is above the last threshold, return the last color.
+    Average one (var_name, year) work unit by census tract and save it as GeoJSON.
     """
-    if not isinstance(value, (int, float)) or value == 0:
-        # Fully transparent
-        return (0, 0, 0, 0)
-
-    for threshold in var_threshold:
-        if value <= threshold["value"]:
-            return threshold["color"]
-    # If value exceeds all var_threshold, return the last color
-    return var_threshold[-1]["color"]
-
-def process_files_geojson(files, tracts_gdf, feature_id):
+    var_name, year = job
+    source = get_shared("points")[var_name]
+    tracts_gdf = get_shared("tracts")
+    feature_id = get_shared("feature_id")
+
+    # Tract means of every year were computed at once, tracts without any point are left out
+    average_value = source["means"][:, source["years"].index(year)]
+    rows = np.nonzero(~np.isnan(average_value))[0]
+
+    # Assign colors based on average values
+    colors = colors_for_values(source["threshold"], average_value[rows])
+
+    # Convert to GeoDataFrame
+    geojson_gdf = gpd.GeoDataFrame({
+        feature_id: tracts_gdf[feature_id].to_numpy()[rows],
+        'average_value': average_value[rows],
+        'color': list(map(tuple, colors.tolist())),
+    }, geometry=tracts_gdf.geometry.values[rows])
+
+    # Define properties for GeoJSON
+    geojson_gdf['color'] = geojson_gdf['color'].apply(lambda c: f"rgba({c[0]}, {c[1]}, {c[2]}, {c[3]})")
+    geojson_gdf = geojson_gdf[[feature_id, 'average_value', 'color', 'geometry']]
+
+    # Define the filename
+    filename = f"ct_{var_name}_{year}.geojson"
+    filepath = os.path.join(binary_data_dir, filename)
+
+    # Save to GeoJSON
+    try:
+        geojson_gdf.to_file(filepath, driver='GeoJSON')
+        print(f"Saved GeoJSON data for {var_name} {year} to {filepath}")
+    except IOError as e:
+        print(f"Failed to save GeoJSON data to {filepath}: {e}")
+
+def process_files_geojson(files, tracts_gdf, feature_id, workers=1):
     """
     Process each variable file to compute average values by census tract and output as GeoJSON.
     """
@@ -45,6 +57,9 @@ def process_files_geojson(files, tracts_gdf, feature_id):
     # Directory to save processed GeoJSON files
     os.makedirs(binary_data_dir, exist_ok=True)  # Create the directory if it doesn't exist
 
+    jobs = []
+    shared = {"tracts": tracts_gdf, "feature_id": feature_id, "points": {}}
+
     for file in files:
         var_name = file["var_name"]
         file_path = file["path"]
@@ -81,50 +96,19 @@ def process_files_geojson(files, tracts_gdf, feature_id):
 
         print(f"Processing variable '{var_name}' for years: {', '.join(years)}")
 
-        for year in years:
-            # Select the value column for the current year
-            if year not in points_gdf.columns:
-                print(f"Year '{year}' not found in {file_path}. Skipping year.")
-                continue
-
-            # Create a GeoDataFrame with only necessary columns
-            df_year = points_gdf[['geometry', year]].copy()
-            df_year = df_year.dropna(subset=[year])
-
-            # Spatial join with tracts to assign each point to a tract
-            try:
-                joined = gpd.sjoin(df_year, tracts_gdf, how='inner', predicate='within')
-            except Exception as e:
-                print(f"Error during spatial join for {var_name} {year}: {e}")
-                continue
-
-            # Group by tract and compute average
-            grouped = joined.groupby(feature_id)[year].mean().reset_index()
-            grouped.rename(columns={year: 'average_value'}, inplace=True)
-
-            # Assign colors based on average values
-            grouped['color'] = grouped['average_value'].apply(lambda x: get_color_for_value(file["threshold"], x))
-
-            # Merge with tracts_gdf to get geometries
-            grouped = grouped.merge(tracts_gdf[[feature_id, 'geometry']], on=feature_id, how='left')
-
-            # Convert to GeoDataFrame
-            geojson_gdf = gpd.GeoDataFrame(grouped, geometry='geometry')
-
-            # Define properties for GeoJSON
-            geojson_gdf['color'] = geojson_gdf['color'].apply(lambda c: f"rgba({c[0]}, {c[1]}, {c[2]}, {c[3]})")
-            geojson_gdf = geojson_gdf[[feature_id, 'average_value', 'color', 'geometry']]
+        # Assign points to tracts once, then average every year in one pass
+        try:
+            point_rows, tract_rows = load_membership(points_gdf, tracts_gdf)
+        except Exception as e:
+            print(f"Error during spatial join for {var_name}: {e}. Skipping {var_name}.")
+            continue
+        means = tract_means(point_rows, tract_rows, len(tracts_gdf), year_matrix(points_gdf, years))
 
-            # Define the filename
-            filename = f"ct_{var_name}_{year}.geojson"
-            filepath = os.path.join(binary_data_dir, filename)
+        shared["points"][var_name] = {"means": means, "years": years, "path": file_path, "threshold": file["threshold"]}
+        jobs.extend((var_name, year) for year in years)
 
-            # Save to GeoJSON
-            try:
-                geojson_gdf.to_file(filepath, driver='GeoJSON')
-                print(f"Saved GeoJSON data for {var_name} {year} to {filepath}")
-            except IOError as e:
-                print(f"Failed to save GeoJSON data to {filepath}: {e}")
+    # Fan the (var_name, year) work units out, tract means and tracts are shared read-only
+    run_jobs(process_year_geojson, jobs, shared, workers)
 
 # Define thresholds and colors as in your original code
 start, end, n = -50, 50, 38
@@ -203,23 +187,28 @@ geojson_files = [
     {"var_name": "prcp", "path": f"{files_path}/Illinois_prcp_risks_round.json", "threshold": prcp_threshold},
 ]
 
-# Load Census Tracts GeoJSON
-tracts_geojson_path = f"{files_path}/cb_2018_17_tract_500k.geojson"  # Update the path accordingly
-try:
-    tracts_gdf = gpd.read_file(tracts_geojson_path)
-except FileNotFoundError:
-    print(f"Census tract file not found: {tracts_geojson_path}. Exiting.")
-    exit(1)
-except Exception as e:
-    print(f"Error loading census tracts GeoJSON: {e}. Exiting.")
-    exit(1)
-
-# Ensure there is a unique identifier for each tract
-# Replace 'GEOID' with the actual property name in your GeoJSON
-# if 'GEOID' not in tracts_gdf.columns:
-#     print("Error: 'GEOID' field not found in census tracts GeoJSON. Please update the code with the correct field name.")
-#     exit(1)
-feat_id = 'GEOID'
-
-# Process the files and output GeoJSON
-process_files_geojson(geojson_files, tracts_gdf, feat_id)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Write the census tract layers as GeoJSON.')
+    add_workers_argument(parser)
+    args = parser.parse_args()
+
+    # Load Census Tracts GeoJSON
+    tracts_geojson_path = f"{files_path}/cb_2018_17_tract_500k.geojson"  # Update the path accordingly
+    try:
+        tracts_gdf = gpd.read_file(tracts_geojson_path)
+    except FileNotFoundError:
+        print(f"Census tract file not found: {tracts_geojson_path}. Exiting.")
+        exit(1)
+    except Exception as e:
+        print(f"Error loading census tracts GeoJSON: {e}. Exiting.")
+        exit(1)
+
+    # Ensure there is a unique identifier for each tract
+    # Replace 'GEOID' with the actual property name in your GeoJSON
+    # if 'GEOID' not in tracts_gdf.columns:
+    #     print("Error: 'GEOID' field not found in census tracts GeoJSON. Please update the code with the correct field name.")
+    #     exit(1)
+    feat_id = 'GEOID'
+
+    # Process the files and output GeoJSON
+    process_files_geojson(geojson_files, tracts_gdf, feat_id, args.workers)